@@ -0,0 +1,166 @@
+# Generates synthetic EssaBuild projects for benchmarking.
+#
+# Usage: python benchmarks/generate_project.py <scenario> <directory> [scale]
+
+import json
+import os
+import sys
+
+
+class ProjectWriter:
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.lines = [
+            "import essabuild as eb",
+            "",
+            f"project = eb.project({name!r})",
+        ]
+
+    def write_file(self, path: str, content: str):
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(content)
+
+    # Writes `count` sources into `directory`, all including one header, and
+    # returns their paths.
+    def write_sources(self, directory: str, count: int) -> list[str]:
+        # Note: Sources are not placed directly in a directory named after
+        #       a target, because its objects would clash with its output.
+        prefix = directory.replace("/", "_")
+        directory = f"src/{directory}"
+        self.write_file(f"{directory}/common.h",
+                        "#pragma once\n\nint common_value();\n")
+        sources = []
+        for index in range(count):
+            path = f"{directory}/source{index}.cpp"
+            self.write_file(
+                path, f'#include "common.h"\n\n'
+                f"int {prefix}_function{index}() {{ return {index}; }}\n")
+            sources.append(path)
+        return sources
+
+    def write_main(self, directory: str) -> str:
+        path = f"src/{directory}/main.cpp"
+        self.write_file(path, "int main() {}\n")
+        return path
+
+    def add_target(self, variable: str, kind: str, name: str,
+                   sources: list[str]):
+        self.lines.append(
+            f"{variable} = project.add_{kind}({name!r}, sources={sources!r})")
+
+    def link(self, variable: str, library: str):
+        self.lines.append(f"{variable}.link({library})")
+
+    def finish(self):
+        self.write_file("build.py", "\n".join(self.lines) + "\n")
+
+
+# One executable compiled from many sources.
+def many_sources(writer: ProjectWriter, scale: int):
+    sources = writer.write_sources("app", 200 * scale)
+    writer.add_target("app", "executable", "app",
+                      [writer.write_main("app"), *sources])
+
+
+# Chain of static libraries, each linking the previous one.
+def deep_chain(writer: ProjectWriter, scale: int):
+    previous = None
+    for index in range(20 * scale):
+        variable = f"lib{index}"
+        writer.add_target(variable, "static_library", variable,
+                          writer.write_sources(variable, 10))
+        if previous:
+            writer.link(variable, previous)
+        previous = variable
+    writer.add_target("app", "executable", "app", [writer.write_main("app")])
+    writer.link("app", previous)
+
+
+# Many libraries linked directly into one executable.
+def wide_libraries(writer: ProjectWriter, scale: int):
+    writer.add_target("app", "executable", "app", [writer.write_main("app")])
+    for index in range(40 * scale):
+        variable = f"lib{index}"
+        writer.add_target(variable, "static_library", variable,
+                          writer.write_sources(variable, 5))
+        writer.link("app", variable)
+
+
+# Many executables sharing a few shared libraries.
+def many_executables(writer: ProjectWriter, scale: int):
+    libraries = []
+    for index in range(5):
+        variable = f"lib{index}"
+        writer.add_target(variable, "shared_library", variable,
+                          writer.write_sources(variable, 10 * scale))
+        libraries.append(variable)
+    for index in range(20 * scale):
+        variable = f"tool{index}"
+        writer.add_target(variable, "executable", variable,
+                          [writer.write_main(variable)])
+        for library in libraries:
+            writer.link(variable, library)
+
+
+# Many generated headers, each included by one executable.
+def generated(writer: ProjectWriter, scale: int):
+    writer.lines += [
+        "",
+        "",
+        "def generate(sources):",
+        "    import json",
+        "    import os",
+        "    for source in sources:",
+        "        with open(eb.config.source_file(source)) as f:",
+        "            data = json.load(f)",
+        "        name = os.path.splitext(os.path.basename(source))[0]",
+        "        os.makedirs(eb.config.build_file('generated'), exist_ok=True)",
+        "        with open(eb.config.build_file(f'generated/{name}.hpp'), 'w') as f:",
+        "            f.write(f'constexpr int {name} = {data[\"value\"]};\\n')",
+        "",
+        "",
+    ]
+    for index in range(20 * scale):
+        variable = f"tool{index}"
+        writer.write_file(f"data/data{index}.json",
+                          json.dumps({"value": index}))
+        writer.lines.append(
+            f"gen{index} = project.add_generated('gen{index}', "
+            f"generator=generate, sources=['data/data{index}.json'], "
+            f"outputs=['generated/data{index}.hpp'])")
+        writer.write_file(
+            f"src/{variable}/main.cpp", f"#include <generated/data{index}.hpp>\n\n"
+            f"int main() {{ return data{index}; }}\n")
+        writer.add_target(variable, "executable", variable,
+                          [f"src/{variable}/main.cpp"])
+        writer.lines.append(
+            f"{variable}.compile_config.add_option(f'-I{{eb.config.build_directory}}')"
+        )
+        writer.link(variable, f"gen{index}")
+
+
+SCENARIOS = {
+    "many-sources": many_sources,
+    "deep-chain": deep_chain,
+    "wide-libraries": wide_libraries,
+    "many-executables": many_executables,
+    "generated": generated,
+}
+
+
+def generate_project(scenario: str, directory: str, scale: int = 1):
+    writer = ProjectWriter(directory, scenario)
+    SCENARIOS[scenario](writer, scale)
+    writer.finish()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in SCENARIOS:
+        print(f"Usage: {sys.argv[0]} <{' | '.join(SCENARIOS)}> <directory> "
+              "[scale]")
+        sys.exit(1)
+    generate_project(sys.argv[1], sys.argv[2],
+                     int(sys.argv[3]) if len(sys.argv) > 3 else 1)
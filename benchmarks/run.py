@@ -0,0 +1,172 @@
+# Benchmarks EssaBuild on synthetic projects and writes results as JSON.
+#
+# Usage: python benchmarks/run.py [-o results.json] [--scale N] [-j N]
+#                                 [--scenario NAME ...]
+#
+# For every scenario, a project is generated in a temporary directory and
+# the following phases are measured (in seconds):
+# - evaluate: execution of build.py,
+# - cached_evaluate: loading of the build graph cached after evaluation,
+#   or null if the project can't be cached (e.g it has generators),
+# - graph: up-to-date checks and construction of the task graph,
+# - schedule: TaskScheduler overhead of going through the graph with tasks
+#   that do nothing,
+# - cold_build, noop_build, touch_rebuild: `main.py build` from scratch,
+#   with nothing changed, and after touching a single source.
+
+import argparse
+import json
+import os
+import platform
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+from generate_project import SCENARIOS, generate_project
+
+ROOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "..")
+MAIN_SCRIPT = os.path.join(ROOT_DIRECTORY, "src", "main.py")
+
+
+# Measures in-process phases. Run in a separate process, so that global
+# state of EssaBuild is fresh for every project.
+def measure_graph(directory: str) -> dict[str, float]:
+    sys.path.append(os.path.join(ROOT_DIRECTORY, "src"))
+    import essabuild as eb
+    import essabuild.BuildSystem
+    from essabuild.BuildState import build_state
+    from essabuild.FileState import file_state
+    from essabuild.GraphCache import graph_cache
+    from essabuild.TaskScheduler import TaskScheduler
+
+    eb.config.source_directory = directory
+    eb.config.build_directory = os.path.join(directory, "build")
+    eb.config.tmp_directory = os.path.join(eb.config.build_directory,
+                                           ".eb_tmp")
+
+    build_file = os.path.join(directory, "build.py")
+    config_values = graph_cache.config_values()
+    start = time.perf_counter()
+    project = essabuild.BuildSystem.load_project(build_file)
+    assert project
+    evaluated = time.perf_counter()
+
+    graph_cache.store(build_file, project, config_values, [])
+    cache_start = time.perf_counter()
+    cached_project = graph_cache.load()
+    cache_loaded = time.perf_counter()
+
+    build_state.ensure_loaded()
+    file_state.prefetch(project.input_files())
+    scheduler = TaskScheduler()
+    task_count = 0
+    for target in project._targets.values():
+        for task in target.get_tasks():
+            scheduler.add_task(task)
+            task_count += 1
+    constructed = time.perf_counter()
+
+    while True:
+        task = scheduler.get_next_task()
+        if not task:
+            break
+        scheduler.mark_as_done(task)
+    scheduled = time.perf_counter()
+
+    return {
+        "evaluate": evaluated - start,
+        # A cache miss must not be compared against loads of cached graphs.
+        "cached_evaluate": cache_loaded - cache_start if cached_project else None,
+        "graph": constructed - cache_loaded,
+        "schedule": scheduled - constructed,
+        "tasks": task_count,
+    }
+
+
+def run_build(directory: str, jobs: int) -> float:
+    start = time.perf_counter()
+    sp.run([sys.executable, MAIN_SCRIPT, "build", "-j",
+            str(jobs)],
+           cwd=directory,
+           stdout=sp.DEVNULL,
+           check=True)
+    return time.perf_counter() - start
+
+
+def run_in_subprocess(directory: str) -> dict[str, float]:
+    output = sp.run(
+        [sys.executable, __file__, "--measure-graph", directory],
+        stdout=sp.PIPE,
+        check=True).stdout
+    return json.loads(output)
+
+
+def benchmark_scenario(scenario: str, scale: int, jobs: int):
+    with tempfile.TemporaryDirectory(prefix=f"eb-bench-{scenario}-") as directory:
+        generate_project(scenario, directory, scale)
+        results = dict[str, float]()
+
+        cold_graph = run_in_subprocess(directory)
+        results["evaluate"] = cold_graph["evaluate"]
+        results["cached_evaluate"] = cold_graph["cached_evaluate"]
+        results["cold_graph"] = cold_graph["graph"]
+        results["cold_schedule"] = cold_graph["schedule"]
+        results["cold_tasks"] = cold_graph["tasks"]
+        results["cold_build"] = run_build(directory, jobs)
+
+        noop_graph = run_in_subprocess(directory)
+        results["noop_graph"] = noop_graph["graph"]
+        results["noop_tasks"] = noop_graph["tasks"]
+        results["noop_build"] = run_build(directory, jobs)
+
+        sources = sorted(
+            os.path.join(root, name)
+            for root, _, files in os.walk(directory)
+            if "build" not in os.path.relpath(root, directory).split(os.sep)
+            for name in files if name.endswith(".cpp"))
+        with open(sources[len(sources) // 2], "a") as f:
+            f.write("\n// touched\n")
+        results["touch_rebuild"] = run_build(directory, jobs)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="file to write results to")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--scenario",
+                        action="append",
+                        choices=list(SCENARIOS),
+                        help="scenario to run (default: all)")
+    parser.add_argument("--measure-graph", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure_graph:
+        json.dump(measure_graph(args.measure_graph), sys.stdout)
+        return
+
+    results = {
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "jobs": args.jobs,
+        "scale": args.scale,
+        "scenarios": {},
+    }
+    for scenario in args.scenario or SCENARIOS:
+        print(f"Running {scenario}...", file=sys.stderr)
+        results["scenarios"][scenario] = benchmark_scenario(
+            scenario, args.scale, args.jobs)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
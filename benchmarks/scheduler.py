@@ -0,0 +1,78 @@
+# Measures overhead of TaskScheduler on a large synthetic task graph.
+#
+# Usage: python benchmarks/scheduler.py [task count] [jobs]
+#
+# Tasks are added in a shuffled order and up to `jobs` tasks are "performed"
+# at once, completing in FIFO order, like with `-j`.
+
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from essabuild.TaskScheduler import Task, TaskScheduler
+
+
+def noop():
+    pass
+
+
+# Creates a graph resembling a project with a chain of static libraries,
+# each compiled from `sources_per_library` sources and linking the previous
+# one, with every 10th library also linked into an executable.
+def make_graph(task_count: int, sources_per_library: int = 50):
+    tasks = list[Task]()
+    previous_link = None
+    while len(tasks) < task_count:
+        sources = [
+            Task(f"build source: {len(tasks) + i}.cpp", noop, [])
+            for i in range(sources_per_library)
+        ]
+        tasks.extend(sources)
+        link = Task(f"link lib{len(tasks)}", noop,
+                    sources + ([previous_link] if previous_link else []))
+        tasks.append(link)
+        if len(tasks) % 10 == 0:
+            tasks.append(Task(f"link exe{len(tasks)}", noop, [link]))
+        previous_link = link
+    return tasks
+
+
+def main():
+    task_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    tasks = make_graph(task_count)
+    random.Random(0).shuffle(tasks)
+
+    start = time.perf_counter()
+    scheduler = TaskScheduler()
+    for task in tasks:
+        scheduler.add_task(task)
+    added = time.perf_counter()
+
+    performed = 0
+    running = collections.deque[Task]()
+    while True:
+        while len(running) < jobs:
+            task = scheduler.get_next_task()
+            if not task:
+                break
+            running.append(task)
+        if not running:
+            break
+        scheduler.mark_as_done(running.popleft())
+        performed += 1
+    end = time.perf_counter()
+
+    assert performed == len(tasks)
+    print(f"tasks:      {len(tasks)}")
+    print(f"add_task:   {(added - start) * 1000:.1f} ms")
+    print(f"scheduling: {(end - added) * 1000:.1f} ms")
+    print(f"total:      {(end - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
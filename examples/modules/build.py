@@ -0,0 +1,13 @@
+import essabuild as eb
+
+project = eb.project("modules")
+
+# Sources are scanned for module declarations and imports, so that modules
+# are compiled before sources importing them.
+project.set_modules()
+
+geometry = project.add_static_library(
+    "geometry", sources=["geometry.cpp", "geometry-shapes.cpp", "geometry-impl.cpp"])
+
+main = project.add_executable("main", sources=["main.cpp"])
+main.link(geometry)
@@ -0,0 +1,5 @@
+module geometry;
+
+double area(const Rectangle& rectangle) {
+    return rectangle.width * rectangle.height;
+}
@@ -0,0 +1,6 @@
+export module geometry:shapes;
+
+export struct Rectangle {
+    double width;
+    double height;
+};
@@ -0,0 +1,5 @@
+export module geometry;
+
+export import :shapes;
+
+export double area(const Rectangle& rectangle);
@@ -0,0 +1,8 @@
+#include <iostream>
+
+import geometry;
+
+int main() {
+    Rectangle rectangle { 3, 4 };
+    std::cout << "Area of the rectangle is " << area(rectangle) << std::endl;
+}
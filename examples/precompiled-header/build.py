@@ -0,0 +1,7 @@
+import essabuild as eb
+
+project = eb.project("precompiled-header")
+
+main = project.add_executable("main", sources=["main.cpp", "print.cpp"])
+# `pch.h` is compiled once and included in front of every source of `main`.
+main.set_precompiled_header("pch.h")
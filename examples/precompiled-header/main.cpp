@@ -0,0 +1,10 @@
+#include "print.h"
+
+int main() {
+    std::vector<std::string> words { "foo", "bar", "foo" };
+    std::map<std::string, int> counts;
+    for (auto const& word : words) {
+        counts[word]++;
+    }
+    print(counts);
+}
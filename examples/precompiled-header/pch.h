@@ -0,0 +1,6 @@
+#pragma once
+
+#include <iostream>
+#include <map>
+#include <string>
+#include <vector>
@@ -0,0 +1,7 @@
+#include "print.h"
+
+void print(std::map<std::string, int> const& values) {
+    for (auto const& [key, value] : values) {
+        std::cout << key << " = " << value << std::endl;
+    }
+}
@@ -0,0 +1,6 @@
+#pragma once
+
+#include <map>
+#include <string>
+
+void print(std::map<std::string, int> const& values);
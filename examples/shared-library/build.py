@@ -0,0 +1,18 @@
+import essabuild as eb
+
+project = eb.project("shared-library")
+# Static libraries only reference their objects instead of copying them.
+project.set_thin_archives()
+# Links need much more memory than compiles, so don't run many at once.
+project.set_pool_limit("link", 1)
+
+util = project.add_static_library("util", sources=["util.cpp"])
+
+greeter = project.add_shared_library("greeter", sources=["greeter.cpp"])
+greeter.link(util)
+
+main = project.add_executable("main", sources=["main.cpp"])
+main.link(greeter)
+# Any linker supported by the compiler's -fuse-ld can be used, e.g "lld" or
+# "mold".
+main.set_linker("gold")
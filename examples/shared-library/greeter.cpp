@@ -0,0 +1,9 @@
+#include "greeter.h"
+#include "util.h"
+
+#include <iostream>
+
+void greet(char const* name)
+{
+    std::cout << exclaim(std::string("Hello from shared library, ") + name) << std::endl;
+}
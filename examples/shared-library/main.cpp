@@ -0,0 +1,5 @@
+#include "greeter.h"
+
+int main() {
+    greet("main");
+}
@@ -0,0 +1,11 @@
+#include "util.h"
+
+// Global data of static libraries linked into shared libraries needs to be
+// compiled as position independent code.
+int exclaim_count = 0;
+
+std::string exclaim(std::string const& text)
+{
+    exclaim_count++;
+    return text + "!";
+}
@@ -0,0 +1,5 @@
+#pragma once
+
+#include <string>
+
+std::string exclaim(std::string const& text);
@@ -0,0 +1,24 @@
+import essabuild as eb
+
+project = eb.project("variants")
+
+# Every variant is built into its own directory (build/<variant>), all in
+# a single build. Use --variant to build only some of them.
+debug = project.add_variant("debug")
+debug.compile_config.add_option("-O0 -g")
+debug.compile_config.add_define("BUILD_VARIANT", "debug")
+
+release = project.add_variant("release")
+release.compile_config.add_option("-O2")
+release.compile_config.add_define("BUILD_VARIANT", "release")
+release.compile_config.add_define("NDEBUG", "1")
+
+asan = project.add_variant("asan")
+asan.compile_config.add_option("-O1 -g -fsanitize=address")
+asan.compile_config.add_define("BUILD_VARIANT", "asan")
+asan.link_config.add_option("-fsanitize=address")
+
+lib = project.add_static_library("lib", sources=["lib.cpp"])
+
+main = project.add_executable("main", sources=["main.cpp"])
+main.link(lib)
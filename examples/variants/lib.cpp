@@ -0,0 +1,8 @@
+#include "lib.h"
+
+#define STRINGIFY_IMPL(x) #x
+#define STRINGIFY(x) STRINGIFY_IMPL(x)
+
+const char* build_variant() {
+    return STRINGIFY(BUILD_VARIANT);
+}
@@ -0,0 +1,3 @@
+#pragma once
+
+const char* build_variant();
@@ -0,0 +1,7 @@
+#include "lib.h"
+
+#include <iostream>
+
+int main() {
+    std::cout << "Hello from " << build_variant() << " build!" << std::endl;
+}
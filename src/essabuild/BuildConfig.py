@@ -1,9 +1,14 @@
+import shlex
+
+
 class BuildConfig:
 
-    def __init__(self, parent):
+    # If `defaults` is True, a config without a parent starts with default
+    # options (e.g the C++ standard).
+    def __init__(self, parent, *, defaults: bool = True):
         self._parent = parent
         self._options = list[str]()
-        if not parent:
+        if not parent and defaults:
             self.set_std("gnu++20")
 
     def add_option(self, option: str):
@@ -15,6 +20,11 @@ class BuildConfig:
     def set_std(self, std: str):
         self.add_option(f"-std={std}")
 
+    # Options are split like a shell would do it, so an option may contain
+    # multiple arguments, e.g "-include header.h".
+    def build_arguments(self) -> list[str]:
+        return (self._parent.build_arguments() if self._parent else
+                []) + [arg for v in self._options for arg in shlex.split(v)]
+
     def build_command_line(self):
-        return (self._parent.build_command_line() + " " if self._parent else
-                "") + " ".join([v for v in self._options])
+        return shlex.join(self.build_arguments())
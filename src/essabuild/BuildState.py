@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+
+from .Config import config
+from .FileState import file_state
+from .UpToDate import UpToDate, check, out_of_date, up_to_date
+
+
+# Returns the path relative to the source directory, if it is in it, for
+# printing.
+def display_path(path: str) -> str:
+    relative = os.path.relpath(path, config.source_directory)
+    return path if relative.startswith(os.pardir) else relative
+
+
+class BuildState:
+    # Persistent state of the build, stored in a single file in the tmp
+    # directory. It is loaded once when first needed and saved once at the
+    # end of the build.
+    #
+    # It stores:
+    # - stat signatures of files known to FileState, so that a file needs
+    #   to be hashed again only when its signature changes,
+    # - for every build product, hashes of its inputs and outputs from the
+    #   time it was built,
+    # - results of scanning source files (see Modules.py), with hashes of
+    #   the files they were scanned from.
+
+    def __init__(self):
+        self._loaded = False
+        self._records = dict[str, dict]()
+        # path -> [hash, result]
+        self._scans = dict[str, list]()
+
+    def path(self):
+        return config.tmp_file("state.json")
+
+    def load(self):
+        self._loaded = True
+        try:
+            with open(self.path()) as f:
+                data = json.load(f)
+            file_state.signatures = data["files"]
+            self._records = data["records"]
+            self._scans = data.get("scans", {})
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            logging.warning("Build state is corrupted, rebuilding everything")
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def save(self):
+        if not self._loaded:
+            return
+        os.makedirs(os.path.dirname(self.path()), exist_ok=True)
+        temporary_path = f"{self.path()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({
+                "files": file_state.signatures,
+                "records": self._records,
+                "scans": self._scans
+            },
+                      f,
+                      separators=(",", ":"))
+        os.replace(temporary_path, self.path())
+
+    # Records current hashes of `inputs` and `outputs` as the ones of the
+    # product identified by `key`. `command` is the command line (or other
+    # description of flags) used to build the product.
+    def record(self,
+               key,
+               inputs: list[str],
+               outputs: list[str] | None = None,
+               command: str | None = None):
+        outputs = outputs or []
+        for path in [*inputs, *outputs]:
+            file_state.invalidate(path)
+        self._records[key] = {
+            "inputs": {path: file_state.hash(path)
+                       for path in inputs},
+            "outputs": {path: file_state.hash(path)
+                        for path in outputs},
+            "command": command,
+        }
+
+    def recorded_inputs(self, key) -> dict[str, str] | None:
+        self.ensure_loaded()
+        record = self._records.get(key)
+        return record["inputs"] if record else None
+
+    def recorded_outputs(self, key) -> dict[str, str] | None:
+        self.ensure_loaded()
+        record = self._records.get(key)
+        return record["outputs"] if record else None
+
+    # Checks that the product identified by `key` was built with the given
+    # command and none of its inputs changed since then.
+    # `command_description` says what the command is in the reason.
+    def inputs_didnt_change(self,
+                            key,
+                            command: str | None = None,
+                            command_description: str = "flags") -> UpToDate:
+        self.ensure_loaded()
+        record = self._records.get(key)
+        if not record:
+            return out_of_date("it wasn't built before")
+        if command is not None and record.get("command") != command:
+            return out_of_date(f"{command_description} changed")
+        return self._files_didnt_change(record["inputs"], "input")
+
+    # Checks that the product identified by `key` was built and its outputs
+    # weren't modified since then.
+    def outputs_didnt_change(self, key) -> UpToDate:
+        recorded_outputs = self.recorded_outputs(key)
+        if recorded_outputs is None:
+            return out_of_date("it wasn't built before")
+        return self._files_didnt_change(recorded_outputs, "output")
+
+    def _files_didnt_change(self, hashes: dict[str, str], kind: str) -> UpToDate:
+        for path, file_hash in hashes.items():
+            try:
+                result = check(file_state.hash(path) == file_hash,
+                               f"{kind} {display_path(path)} changed")
+            except FileNotFoundError:
+                result = out_of_date(f"{kind} {display_path(path)} is missing")
+            if not result:
+                return result
+        return up_to_date
+
+    # Returns the result of scanning the file recorded by record_scan, or
+    # None if the file changed since then.
+    def scan_result(self, path):
+        self.ensure_loaded()
+        entry = self._scans.get(path)
+        if entry and entry[0] == file_state.hash(path):
+            return entry[1]
+        return None
+
+    def record_scan(self, path, result):
+        self._scans[path] = [file_state.hash(path), result]
+
+
+build_state = BuildState()
@@ -1,7 +1,14 @@
+from .FileState import file_state
 from .Config import config
+from .GraphCache import graph_cache, imported_files
 from .Project import Project
+from .NinjaGenerator import NinjaWriter
+from .Watcher import create_watcher
 
+import logging
 import os
+import sys
+import traceback
 
 root_project: Project | None = None
 
@@ -14,15 +21,118 @@ def project(name):
     return root_project
 
 
-def main(*, build: bool, run: bool, run_target: str | None):
+# Evaluates the build.py script, which defines the root project.
+def load_project(filename: str):
+    global root_project
+    root_project = None
+    with open(filename) as f:
+        compiled = compile(f.read(), filename, "exec")
+    exec(compiled, {"__name__": "__essabuild__", "__file__": filename})
+    return root_project
+
+
+# Like load_project, but reuses the project evaluated by the previous run
+# if build.py and everything it depends on didn't change since then.
+def load_cached_project(filename: str):
+    global root_project
+    if config.graph_cache:
+        root_project = graph_cache.load()
+        if root_project:
+            logging.info("Using cached build graph")
+            return root_project
+
+    config_values = graph_cache.config_values()
+    old_modules = set(sys.modules)
+    load_project(filename)
+    if root_project and config.graph_cache:
+        graph_cache.store(filename, root_project, config_values,
+                          imported_files(old_modules))
+    return root_project
+
+
+# Builds the project every time some of its input files change. The project
+# is kept loaded, and build.py is evaluated again only if it changes itself.
+def watch(build_file: str, targets: list[str] | None = None):
+    global root_project
+    assert root_project
+    watcher = create_watcher()
+    while True:
+        try:
+            root_project.build(targets)
+        except Exception:
+            traceback.print_exc()
+
+        # Files in the build directory are written by the build itself.
+        paths = {build_file}
+        try:
+            paths |= {
+                path
+                for path in root_project.input_files(targets)
+                if not path.startswith(config.build_directory + os.sep)
+            }
+        except Exception:
+            # The requested targets may not exist in the changed build.py.
+            traceback.print_exc()
+        print(f"\033[34;1mWatching {len(paths)} files for changes\033[m")
+        changed = watcher.wait(paths)
+        print(f"\033[34;1mChanged:\033[m {', '.join(sorted(changed))}")
+
+        if build_file in changed:
+            file_state.invalidate()
+            old_project = root_project
+            try:
+                if not load_project(build_file):
+                    raise Exception("No project was defined")
+            except Exception:
+                traceback.print_exc()
+                root_project = old_project
+                root_project.reset()
+        else:
+            for path in changed:
+                file_state.invalidate(path)
+            root_project.reset()
+
+
+def main(*,
+         build: bool,
+         run: bool,
+         run_target: str | None,
+         build_targets: list[str] | None = None,
+         watch_file: str | None = None,
+         generate_ninja: list[str] | None = None,
+         generator_target: str | None = None) -> int:
     global root_project
     if not root_project:
         raise Exception("No project was defined")
 
-    if build:
+    if build or watch_file or generate_ninja:
         os.makedirs(config.build_directory, exist_ok=True)
         os.makedirs(config.tmp_directory, exist_ok=True)
-        root_project.build()
+
+    if generate_ninja:
+        writer = NinjaWriter(root_project)
+        writer.write(config.source_file("build.py"), generate_ninja)
+        print(f"\033[34;1mWritten:\033[m {writer.path()}")
+        return 0
+
+    if generator_target:
+        root_project.run_generator(generator_target)
+        return 0
+
+    if watch_file:
+        try:
+            watch(watch_file, build_targets)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    # Only the target that is run is built.
+    if run and run_target:
+        build_targets = [run_target]
+
+    if build and not root_project.build(build_targets):
+        return 1
 
     if run:
-        root_project.run(run_target)
+        return root_project.run(run_target)
+    return 0
@@ -12,6 +12,68 @@ class Config:
     # temporary files (e.g object, caches)
     tmp_directory: str
 
+    # Maximum number of tasks that are performed in parallel.
+    jobs: int = os.cpu_count() or 1
+
+    # Addresses ("host:port") of remote workers that C++ sources are
+    # compiled on. If empty, everything is built locally.
+    remote_workers: list[str] = []
+
+    # Maximum number of compile jobs sent to remote workers at once.
+    remote_window: int = 16
+
+    # Whether the project evaluated from build.py is cached in the tmp
+    # directory, so that build.py is not executed again until it changes.
+    graph_cache: bool = True
+
+    # Names of variants to build, or None to build all variants declared in
+    # build.py.
+    variants: list[str] | None = None
+
+    # Whether reasons why tasks are performed are printed.
+    explain: bool = False
+
+    # Whether tasks that would be performed are only printed, without
+    # performing them.
+    dry_run: bool = False
+
+    # Whether the build goes on with tasks that don't depend on a failed
+    # task, instead of stopping at the first failure.
+    keep_going: bool = False
+
+    # Maximum numbers of tasks performed at once per resource pool, e.g
+    # {"link": 2}. These override limits set in build.py.
+    pool_limits: dict[str, int] = {}
+
+    # New tasks are not started while the 1-minute load average is above
+    # this, or None to ignore the load.
+    max_load: float | None = None
+
+    # New tasks are not started while less memory (in bytes) is available,
+    # or None to ignore available memory.
+    min_free_memory: int | None = None
+
+    # Number of processes running generators concurrently, or 0 to run them
+    # in the build process.
+    generator_processes: int = 0
+
+    # Path of the Chrome trace event file written after the build, or None.
+    trace_file: str | None = None
+
+    # Directory of the object cache shared between build directories, or
+    # None if the cache is disabled.
+    cache_directory: str | None = None
+
+    # Overrides unity build mode declared in build.py for all targets:
+    # True enables it, False disables it, None leaves it as declared.
+    unity_build: bool | None = None
+
+    # Default number of sources compiled together in one unity batch.
+    unity_batch_size: int = 8
+
+    # Size in bytes above which least recently used cached objects are removed.
+    cache_max_size: int = 5 * 1024 * 1024 * 1024
+
     def source_file(self, path: str):
         return os.path.join(self.source_directory, path)
 
@@ -0,0 +1,134 @@
+import abc
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from .Config import config
+from .Remote import NoWorkerAvailable, RemoteCompileClient
+from .TaskScheduler import Task
+from .Trace import BuildTrace, TaskTrace
+from .Utils import CommandError, buffered_task_output, recorded_task_commands
+
+# Output of a performed task and a formatted traceback if it failed.
+TaskResult = tuple[str, str | None]
+
+
+# Performs the task (or `worker` instead of its own worker) on the current
+# thread, capturing its output.
+def perform_task(task: Task,
+                 trace: BuildTrace | None,
+                 worker: Callable[[], None] | None = None) -> TaskResult:
+    start = trace.now() if trace else 0
+    with buffered_task_output() as output, recorded_task_commands() as commands:
+        try:
+            (worker or task.worker)()
+            error = None
+        except CommandError as e:
+            # Output of the command says what went wrong, so the traceback
+            # would be just noise.
+            error = f"{e}\n"
+        except Exception:
+            error = traceback.format_exc()
+    if trace:
+        trace.add(
+            TaskTrace(task, trace.current_lane(), start, trace.now(),
+                      commands))
+    return output.getvalue(), error
+
+
+class Executor(abc.ABC):
+    # Performs tasks of a build, in parallel.
+
+    def __init__(self, trace: BuildTrace | None):
+        self._trace = trace
+
+    # Maximum number of tasks that should be submitted at once.
+    @abc.abstractmethod
+    def capacity(self) -> int:
+        return
+
+    @abc.abstractmethod
+    def submit(self, task: Task) -> 'Future[TaskResult]':
+        return
+
+    @abc.abstractmethod
+    def shutdown(self):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+class LocalExecutor(Executor):
+    # Performs tasks on `jobs` threads of this process.
+
+    def __init__(self, trace: BuildTrace | None, jobs: int):
+        super().__init__(trace)
+        self._jobs = max(jobs, 1)
+        self._pool = ThreadPoolExecutor(self._jobs)
+
+    def capacity(self):
+        return self._jobs
+
+    def submit(self, task: Task):
+        return self._pool.submit(perform_task, task, self._trace)
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+
+class RemoteExecutor(Executor):
+    # Performs tasks that can be performed remotely (i.e compilation of C++
+    # sources) through remote workers, and all other tasks locally. Sources
+    # are still preprocessed locally, on up to `window` additional threads.
+    # If no worker is available, remote tasks are performed locally as
+    # well.
+
+    def __init__(self, trace: BuildTrace | None, jobs: int,
+                 client: RemoteCompileClient, window: int):
+        super().__init__(trace)
+        self._local = LocalExecutor(trace, jobs)
+        self._client = client
+        self._window = max(window, 1)
+        self._remote_pool = ThreadPoolExecutor(self._window)
+
+    def capacity(self):
+        return self._local.capacity() + self._window
+
+    def submit(self, task: Task):
+        if not task.remote_worker or not self._client.available():
+            return self._local.submit(task)
+        return self._remote_pool.submit(self._perform_remotely, task)
+
+    def _perform_remotely(self, task: Task) -> TaskResult:
+        assert task.remote_worker
+        remote_worker = task.remote_worker
+        fallback = False
+
+        def worker():
+            nonlocal fallback
+            try:
+                remote_worker(self._client)
+            except NoWorkerAvailable:
+                fallback = True
+
+        result = perform_task(task, self._trace, worker)
+        if fallback:
+            return self._local.submit(task).result()
+        return result
+
+    def shutdown(self):
+        self._remote_pool.shutdown()
+        self._local.shutdown()
+
+
+def create_executor(trace: BuildTrace | None) -> Executor:
+    if config.remote_workers:
+        return RemoteExecutor(
+            trace, config.jobs,
+            RemoteCompileClient(config.remote_workers, config.remote_window),
+            config.remote_window)
+    return LocalExecutor(trace, config.jobs)
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable
+
+from .Config import config
+
+
+def calculate_file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class FileState:
+    # Content hashes of files in the current build session. Every file is
+    # hashed at most once per session, even if it is looked up from many
+    # threads at once, until it is invalidated.
+    #
+    # Files are actually read only if their stat signature (mtime, size,
+    # inode) differs from the one they had when they were last hashed. The
+    # signatures are persisted by BuildState.
+
+    # Files modified this recently may still be modified within the same
+    # mtime tick, so their hashes are not trusted based on stat alone.
+    RACY_INTERVAL_NS = 2_000_000_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = dict[str, Future]()
+        # path -> [mtime_ns, size, inode, hash]
+        self.signatures = dict[str, list]()
+
+    def _calculate_hash(self, path) -> str:
+        st = os.stat(path)
+        signature = [st.st_mtime_ns, st.st_size, st.st_ino]
+        entry = self.signatures.get(path)
+        if entry and entry[:3] == signature:
+            return entry[3]
+
+        file_hash = calculate_file_hash(path)
+        if time.time_ns() - st.st_mtime_ns > self.RACY_INTERVAL_NS:
+            self.signatures[path] = [*signature, file_hash]
+        else:
+            self.signatures.pop(path, None)
+        return file_hash
+
+    # Returns content hash of the file. Raises FileNotFoundError if it
+    # doesn't exist.
+    def hash(self, path) -> str:
+        with self._lock:
+            future = self._hashes.get(path)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._hashes[path] = future
+
+        if is_owner:
+            try:
+                future.set_result(self._calculate_hash(path))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    # Hashes all given files in parallel, so that later lookups are free.
+    def prefetch(self, paths: Iterable[str]):
+        paths = [path for path in set(paths) if path not in self._hashes]
+        if not paths:
+            return
+
+        def try_hash(path):
+            try:
+                self.hash(path)
+            except OSError:
+                pass
+
+        with ThreadPoolExecutor(max(config.jobs, 1)) as executor:
+            list(executor.map(try_hash, paths))
+
+    # Must be called when a file is modified during the build, e.g by a
+    # generator. If `path` is None, all files are looked up again.
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._hashes.clear()
+            else:
+                self._hashes.pop(path, None)
+
+
+file_state = FileState()
@@ -0,0 +1,74 @@
+import io
+import multiprocessing
+import sys
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from .Config import config
+
+
+# Runs in worker processes. Generators are functions defined in build.py,
+# which can't be sent to other processes, so every worker evaluates
+# build.py itself and looks generators up by target name.
+def _initialize_worker(config_values: dict, build_file: str):
+    from . import BuildSystem
+    for name, value in config_values.items():
+        setattr(config, name, value)
+    BuildSystem.load_project(build_file)
+
+
+def _run_generator(target_name: str) -> tuple[str, str | None]:
+    from . import BuildSystem
+    assert BuildSystem.root_project
+    old_stdout = sys.stdout
+    sys.stdout = output = io.StringIO()
+    try:
+        BuildSystem.root_project.run_generator(target_name)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.stdout = old_stdout
+    return output.getvalue(), error
+
+
+class GeneratorPool:
+    # Pool of processes running generators, so that independent generators
+    # written in Python run concurrently despite the GIL.
+
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return config.generator_processes > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if not self._executor:
+                self._executor = ProcessPoolExecutor(
+                    config.generator_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_initialize_worker,
+                    initargs=(vars(config).copy(),
+                              config.source_file("build.py")))
+            return self._executor
+
+    # Runs generator of the given target in a worker process, and waits
+    # for it to finish.
+    def run(self, target_name: str):
+        output, error = self._get_executor().submit(_run_generator,
+                                                    target_name).result()
+        sys.stdout.write(output)
+        if error:
+            raise Exception(f"Generator of {target_name} failed:\n{error}")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+
+generator_pool = GeneratorPool()
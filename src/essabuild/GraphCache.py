@@ -0,0 +1,126 @@
+import glob
+import logging
+import os
+import pickle
+import sys
+from typing import TYPE_CHECKING
+
+from .Config import config
+from .FileState import calculate_file_hash
+from .Target import GeneratedTarget
+
+if TYPE_CHECKING:
+    from .Project import Project
+
+# Options that only affect how the build is performed, so changing them
+# doesn't invalidate the cached graph.
+_IGNORED_CONFIG_VALUES = {
+    "jobs", "generator_processes", "trace_file", "cache_directory",
+    "cache_max_size", "graph_cache", "remote_workers", "remote_window",
+    "pool_limits", "max_load", "min_free_memory", "keep_going", "variants",
+    "explain", "dry_run"
+}
+
+
+def _essabuild_files() -> list[str]:
+    return sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py")))
+
+
+# Returns files of modules imported since `old_modules` were loaded.
+def imported_files(old_modules: set[str]) -> list[str]:
+    files = []
+    for name in sys.modules.keys() - old_modules:
+        path = getattr(sys.modules[name], "__file__", None)
+        if path and os.path.exists(path):
+            files.append(os.path.abspath(path))
+    return files
+
+
+class GraphCache:
+    # Stores the project evaluated from build.py in the tmp directory, so
+    # that build.py doesn't need to be executed again if neither it, nor
+    # modules it imported, nor EssaBuild itself changed.
+    #
+    # Projects with generators are not cached, because generators are
+    # functions defined in build.py, which can't be serialized. Neither are
+    # projects that can't be pickled for another reason (e.g they use
+    # Source subclasses defined in build.py).
+
+    def path(self):
+        return config.tmp_file("graph.pickle")
+
+    def config_values(self):
+        return {
+            name: value
+            for name, value in sorted(vars(config).items())
+            if name not in _IGNORED_CONFIG_VALUES
+        }
+
+    def _is_valid(self, data: dict) -> bool:
+        if data["config"] != self.config_values():
+            return False
+        for path, file_hash in data["files"].items():
+            try:
+                if calculate_file_hash(path) != file_hash:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    # Returns the cached project, or None if there is none or it is
+    # outdated.
+    def load(self) -> 'Project | None':
+        try:
+            with open(self.path(), "rb") as f:
+                data = pickle.load(f)
+            if not self._is_valid(data):
+                return None
+            # build.py may have changed the config as well.
+            for name, value in data["evaluated_config"].items():
+                setattr(config, name, value)
+            return data["project"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Failed to load cached build graph: {e}")
+            return None
+
+    # `config_values` are values of the config from before build.py was
+    # executed, and `dependencies` are files of modules that it imported.
+    def store(self, build_file: str, project: 'Project',
+              config_values: dict, dependencies: list[str]):
+        if any(
+                isinstance(target, GeneratedTarget)
+                for target in project._targets.values()):
+            self.remove()
+            return
+
+        files = [build_file, *dependencies, *_essabuild_files()]
+        data = {
+            "config": config_values,
+            "evaluated_config": self.config_values(),
+            "files": {path: calculate_file_hash(path)
+                      for path in files},
+            "project": project,
+        }
+        try:
+            serialized = pickle.dumps(data)
+        except Exception as e:
+            logging.info(f"Build graph can't be cached: {e}")
+            self.remove()
+            return
+
+        os.makedirs(os.path.dirname(self.path()), exist_ok=True)
+        temporary_path = f"{self.path()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(serialized)
+        os.replace(temporary_path, self.path())
+
+    def remove(self):
+        try:
+            os.remove(self.path())
+        except FileNotFoundError:
+            pass
+
+
+graph_cache = GraphCache()
@@ -0,0 +1,65 @@
+import os
+import time
+
+from .Config import config
+
+
+def available_memory() -> int | None:
+    # Returns memory available for new processes in bytes, or None if it
+    # is unknown.
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class LoadThrottle:
+    # Decides whether more tasks can be started, based on the system load
+    # average and available memory. This lets builds use a high -j without
+    # overloading the machine when other things run on it, or when tasks
+    # turn out to be heavier than expected.
+
+    # Measurements are reused for this long, as they change slowly anyway.
+    CHECK_INTERVAL_SECONDS = 0.2
+
+    def __init__(self, max_load: float | None, min_free_memory: int | None):
+        self._max_load = max_load
+        self._min_free_memory = min_free_memory
+        self._last_check = 0.0
+        self._overloaded = False
+
+    def enabled(self):
+        return self._max_load is not None or self._min_free_memory is not None
+
+    def _check_overloaded(self):
+        if self._max_load is not None:
+            try:
+                if os.getloadavg()[0] > self._max_load:
+                    return True
+            except OSError:
+                pass
+        if self._min_free_memory is not None:
+            memory = available_memory()
+            if memory is not None and memory < self._min_free_memory:
+                return True
+        return False
+
+    # Returns True if a new task may be started while `running` tasks are
+    # being performed. At least one task can always run, so that the build
+    # makes progress.
+    def can_start(self, running: int) -> bool:
+        if running == 0 or not self.enabled():
+            return True
+        now = time.monotonic()
+        if now - self._last_check >= self.CHECK_INTERVAL_SECONDS:
+            self._overloaded = self._check_overloaded()
+            self._last_check = now
+        return not self._overloaded
+
+
+def create_load_throttle():
+    return LoadThrottle(config.max_load, config.min_free_memory)
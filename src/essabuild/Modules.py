@@ -0,0 +1,67 @@
+import re
+
+from .BuildState import build_state
+
+# Comments and literals may contain anything, so they are removed before
+# declarations are looked for.
+_COMMENT_OR_LITERAL = re.compile(
+    r"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", re.S)
+# Module declarations and imports of named modules. Header units (e.g
+# `import <vector>;`) are not supported.
+_DECLARATION = re.compile(
+    r"^[ \t]*(export[ \t]+)?(module|import)(?=[\s:;])[ \t]*([\w.]*(?::[\w.]+)?)[ \t]*;",
+    re.M)
+
+
+class ModuleInfo:
+    # `provides` is the module (or partition, named "module:partition")
+    # that the source is a unit of and whose BMI (compiled module interface)
+    # it produces. `requires` are names of modules whose BMIs are needed to
+    # compile it.
+
+    def __init__(self, provides: str | None, requires: list[str]):
+        self.provides = provides
+        self.requires = requires
+
+    def declares_modules(self) -> bool:
+        return self.provides is not None or len(self.requires) > 0
+
+
+def _scan(content: str) -> dict:
+    content = _COMMENT_OR_LITERAL.sub(" ", content)
+    provides = None
+    requires = list[str]()
+    # Name of the module that the source is a unit of, used to resolve
+    # imports of its partitions.
+    module = None
+    for export, keyword, name in _DECLARATION.findall(content):
+        if keyword == "module":
+            # `module;` starts the global module fragment and
+            # `module :private;` the private one.
+            if not name or name.startswith(":"):
+                continue
+            module = name.partition(":")[0]
+            # Partitions have BMIs even if they are not exported.
+            if export or ":" in name:
+                provides = name
+            else:
+                # Implementation units implicitly import their module.
+                requires.append(name)
+        elif name.startswith(":"):
+            if module:
+                requires.append(f"{module}{name}")
+        elif name:
+            requires.append(name)
+    return {"provides": provides, "requires": list(dict.fromkeys(requires))}
+
+
+# Returns modules provided and required by the source. The result is stored
+# in the build state, so that the source is scanned again only if it
+# changes.
+def scan_module_declarations(path: str) -> ModuleInfo:
+    result = build_state.scan_result(path)
+    if result is None:
+        with open(path, errors="replace") as f:
+            result = _scan(f.read())
+        build_state.record_scan(path, result)
+    return ModuleInfo(result["provides"], result["requires"])
@@ -0,0 +1,251 @@
+import os
+import shlex
+import sys
+
+from .Config import config
+from .Source import CppCompiledSource
+from .Target import CppTarget, CppTargetType, GeneratedTarget
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .Project import Project
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                           "main.py")
+
+
+def escape_path(path: str) -> str:
+    return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def escape_value(value: str) -> str:
+    return value.replace("$", "$$").replace("\n", " ")
+
+
+class NinjaWriter:
+    # Writes a build.ninja file equivalent to the task graph of a project.
+    # build.py stays the source of truth: the file regenerates itself when
+    # build.py changes, and generators are run through main.py.
+
+    def __init__(self, project: 'Project'):
+        self._project = project
+        self._lines = list[str]()
+        self._pool_limits = project.effective_pool_limits()
+        # Objects shared by multiple targets must be written only once.
+        self._written_objects = set[str]()
+
+    def _variable(self, name: str, value: str, indent: bool = False):
+        self._lines.append(
+            f"{'  ' if indent else ''}{name} = {escape_value(value)}")
+
+    def _build(self,
+               outputs: list[str],
+               rule: str,
+               inputs: list[str],
+               implicit: list[str] = [],
+               order_only: list[str] = [],
+               variables: dict[str, str] = {},
+               implicit_outputs: list[str] = []):
+        line = f"build {' '.join(map(escape_path, outputs))}"
+        if implicit_outputs:
+            line += f" | {' '.join(map(escape_path, implicit_outputs))}"
+        line += f": {rule}"
+        if inputs:
+            line += f" {' '.join(map(escape_path, inputs))}"
+        if implicit:
+            line += f" | {' '.join(map(escape_path, implicit))}"
+        if order_only:
+            line += f" || {' '.join(map(escape_path, order_only))}"
+        self._lines.append(line)
+        for name, value in variables.items():
+            self._variable(name, value, indent=True)
+
+    # Returns variables assigning an edge to the pool, if the pool is
+    # limited.
+    def _pool_variables(self, pool: str) -> dict[str, str]:
+        return {"pool": pool} if pool in self._pool_limits else {}
+
+    def _write_pools(self):
+        for pool, limit in self._pool_limits.items():
+            self._lines += [f"pool {pool}", f"  depth = {limit}", ""]
+
+    def _write_rules(self, build_file: str, arguments: list[str]):
+        python = shlex.quote(sys.executable)
+        main_script = shlex.quote(MAIN_SCRIPT)
+        source_directory = shlex.quote(config.source_directory)
+        self._lines += [
+            "ninja_required_version = 1.7",
+            f"builddir = {escape_path(config.tmp_directory)}",
+            "",
+            "rule cxx",
+            "  command = g++ -c $in -o $out -MMD -MF $out.d $flags",
+            "  depfile = $out.d",
+            "  deps = gcc",
+            "  description = CXX $in",
+            "",
+            # With modules, GCC adds rules describing them to depfiles, which
+            # ninja doesn't understand, so only the first rule is kept.
+            "rule cxx_modules",
+            "  command = g++ -c $in -o $out -MMD -MF $out.d.in $flags && "
+            "sed '/[^\\\\]$$/q' $out.d.in > $out.d",
+            "  depfile = $out.d",
+            "  deps = gcc",
+            "  description = CXX $in",
+            "",
+            "rule pch",
+            "  command = g++ -x c++-header $in -o $out -MMD -MF $out.d $flags",
+            "  depfile = $out.d",
+            "  deps = gcc",
+            "  description = PCH $in",
+            "",
+            "rule link",
+            "  command = g++ -o $out $in $libs $flags",
+            "  description = LINK $out",
+            "",
+            "rule link_shared",
+            "  command = g++ -shared -o $out -Wl,-soname,$soname $in $libs $flags",
+            "  description = LINK $out",
+            "",
+            "rule ar",
+            "  command = rm -f $out && ar -rcs $arflags $out $in",
+            "  description = AR $out",
+            "",
+            # The generator may leave its outputs untouched, in which case
+            # ninja doesn't need to rebuild anything depending on them.
+            "rule generate",
+            f"  command = cd {source_directory} && {python} {main_script} "
+            f"run-generator $target && touch $stamp",
+            "  description = GENERATE $target",
+            "  restat = 1",
+            "",
+            "rule regenerate",
+            f"  command = cd {source_directory} && {python} {main_script} "
+            f"{' '.join(map(shlex.quote, arguments))}",
+            "  description = Regenerating build.ninja",
+            "  generator = 1",
+            "",
+        ]
+        self._build([self.path()], "regenerate", [build_file])
+        self._lines.append("")
+
+    def path(self):
+        return config.build_file("build.ninja")
+
+    def _stamp_path(self, target: GeneratedTarget):
+        return config.tmp_file(f"generated/{target.name()}.stamp")
+
+    def _write_generated_target(self, target: GeneratedTarget):
+        self._build([self._stamp_path(target), *target.output_paths()],
+                    "generate",
+                    [config.source_file(path) for path in target._sources],
+                    variables={
+                        "target": target.name(),
+                        "stamp": self._stamp_path(target),
+                        **self._pool_variables("generate"),
+                    })
+
+    def _write_cpp_target(self, target: CppTarget):
+        generated_stamps = [
+            self._stamp_path(lib) for lib in target.linked_targets()
+            if isinstance(lib, GeneratedTarget)
+        ]
+
+        pch_implicit = []
+        pch = target.precompiled_header
+        if pch:
+            pch.write_wrapper()
+            self._build([pch.gch_path()],
+                        "pch", [pch.wrapper_path()],
+                        order_only=generated_stamps,
+                        variables={
+                            "flags": pch.command_line(),
+                            **self._pool_variables("compile"),
+                        })
+            pch_implicit = [pch.gch_path()]
+
+        objects = []
+        for src in target._get_build_units():
+            if not isinstance(src, CppCompiledSource):
+                continue
+            objects.append(src.object_file_path())
+            if src.object_file_path() in self._written_objects:
+                continue
+            self._written_objects.add(src.object_file_path())
+            # BMIs of modules are outputs of sources providing them and
+            # inputs of sources importing them.
+            bmi_path = src.bmi_path()
+            self._build([src.object_file_path()],
+                        "cxx_modules" if target.uses_modules() else "cxx",
+                        [src.source_file_path()],
+                        implicit=[*pch_implicit, *src.required_bmi_paths()],
+                        order_only=generated_stamps,
+                        variables={
+                            "flags": src.command_line(),
+                            **self._pool_variables("compile"),
+                        },
+                        implicit_outputs=[bmi_path] if bmi_path else [])
+
+        # Libraries linked to static libraries are linked (through $libs)
+        # to their users, so these depend on them as well.
+        libraries = [
+            path for lib in target._linked_libraries()
+            for path in lib.link_artifacts()
+        ]
+        linker = target.linker or self._project.linker
+        link_flags = shlex.join([
+            *([f"-fuse-ld={linker}"] if linker else []),
+            *target.link_arguments()
+        ])
+        link_pool = self._pool_variables(target.link_pool or "link")
+        match target.target_type:
+            case CppTargetType.EXECUTABLE:
+                self._build([target.executable_path()],
+                            "link",
+                            objects,
+                            implicit=libraries,
+                            variables={
+                                "libs": shlex.join(target._library_link_options()),
+                                "flags": link_flags,
+                                **link_pool,
+                            })
+            case CppTargetType.SHARED_LIBRARY:
+                self._build([target.executable_path()],
+                            "link_shared",
+                            objects,
+                            implicit=libraries,
+                            variables={
+                                "libs": shlex.join(target._library_link_options()),
+                                "flags": link_flags,
+                                "soname": os.path.basename(target.executable_path()),
+                                **link_pool,
+                            })
+            case CppTargetType.STATIC_LIBRARY:
+                self._build([target.executable_path()],
+                            "ar",
+                            objects,
+                            variables={
+                                "arflags": "--thin" if target._is_thin_archive() else "",
+                                **link_pool,
+                            })
+
+    # `arguments` are main.py arguments that regenerate the file.
+    def write(self, build_file: str, arguments: list[str]):
+        self._write_pools()
+        self._write_rules(build_file, arguments)
+        # Generated targets are shared by all variants.
+        written_generated_targets = set[GeneratedTarget]()
+        for project in self._project.variant_projects():
+            project.write_module_mapper()
+            for target in project._targets.values():
+                if isinstance(target, GeneratedTarget):
+                    if target in written_generated_targets:
+                        continue
+                    written_generated_targets.add(target)
+                    self._write_generated_target(target)
+                elif isinstance(target, CppTarget):
+                    self._write_cpp_target(target)
+                self._lines.append("")
+
+        os.makedirs(os.path.dirname(self.path()), exist_ok=True)
+        with open(self.path(), "w") as f:
+            f.write("\n".join(self._lines))
@@ -0,0 +1,140 @@
+import functools
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess as sp
+import threading
+
+from .Config import config
+
+
+@functools.cache
+def compiler_identity(compiler: str) -> str:
+    path = shutil.which(compiler) or compiler
+    real_path = os.path.realpath(path)
+    st = os.stat(real_path)
+    version = sp.run([path, "--version"], stdout=sp.PIPE,
+                     stderr=sp.STDOUT).stdout
+    return hashlib.md5(
+        f"{real_path}:{st.st_size}:{st.st_mtime_ns}:".encode() +
+        version).hexdigest()
+
+
+class ObjectCache:
+    # Local content-addressed cache of compiled object files, shared between
+    # all build directories that use the same cache directory. Objects are
+    # keyed by the preprocessed source, compile flags and compiler identity.
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Number of objects stored since the cache was last evicted.
+        self._stored = 0
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return config.cache_directory is not None
+
+    def key(self, preprocessed_path: str, command_line: str,
+            compiler: str) -> str:
+        key = hashlib.md5()
+        key.update(compiler_identity(compiler).encode())
+        # Debug info contains paths of sources and the directory that they
+        # were compiled in, so objects with it can only be shared between
+        # builds in the same directory (like ccache's hash_dir).
+        debug_info = any(
+            arg.startswith("-g") and arg != "-g0"
+            for arg in shlex.split(command_line))
+        if debug_info:
+            key.update(f"{os.getcwd()}\0".encode())
+            key.update(command_line.encode())
+        else:
+            # Make keys independent of where the project is checked out.
+            key.update(
+                command_line.replace(config.source_directory,
+                                     "<source>").encode())
+        with open(preprocessed_path, "rb") as f:
+            for line in f:
+                # Linemarkers contain absolute paths, which would make
+                # identical translation units in different checkouts miss.
+                if not debug_info and line.startswith(b"# ") and line[2:3].isdigit():
+                    continue
+                key.update(line)
+        return key.hexdigest()
+
+    def _entry_path(self, key: str):
+        return os.path.join(config.cache_directory, key[:2], f"{key}.o")
+
+    # Places cached object with the given key at `object_path`. Returns
+    # False if there is no such object in the cache.
+    def fetch(self, key: str, object_path: str) -> bool:
+        entry_path = self._entry_path(key)
+        try:
+            if os.path.exists(object_path):
+                os.remove(object_path)
+            try:
+                os.link(entry_path, object_path)
+            except OSError:
+                shutil.copyfile(entry_path, object_path)
+            # Entries are evicted in the order of last use.
+            os.utime(entry_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, object_path: str):
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temporary_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}"
+        shutil.copyfile(object_path, temporary_path)
+        os.replace(temporary_path, entry_path)
+        with self._lock:
+            self._stored += 1
+
+    # Removes least recently used entries until the cache fits in
+    # config.cache_max_size.
+    def evict(self):
+        entries = []
+        total_size = 0
+        for directory, _, files in os.walk(config.cache_directory):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, path))
+                total_size += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= config.cache_max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def finish(self):
+        if not self.enabled():
+            return
+        # The cache can only grow past its limit when objects are stored, so
+        # it isn't walked at the end of builds that didn't store any.
+        if self._stored > 0:
+            self.evict()
+            self._stored = 0
+        lookups = self.hits + self.misses
+        if lookups > 0:
+            print(f"\033[34;1mObject cache:\033[m {self.hits} hits, "
+                  f"{self.misses} misses "
+                  f"({self.hits * 100 // lookups}% hit rate)")
+
+
+object_cache = ObjectCache()
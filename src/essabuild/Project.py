@@ -1,23 +1,197 @@
+import copy
 import logging
+import os
 import subprocess as sp
-import traceback
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from typing import Callable, Union
 
-from .Source import Source
+from .BuildState import build_state
+from .Config import config
+from .Executor import create_executor
+from .FileState import file_state
+from .GeneratorPool import generator_pool
+from .LoadThrottle import create_load_throttle
+from .ObjectCache import object_cache
+from .Source import CppCompiledSource, Source
 from .Target import Target, CppTarget, CppTargetType, GeneratedTarget
-from .TaskScheduler import TaskScheduler
+from .TaskScheduler import Task, TaskScheduler
 from .BuildConfig import BuildConfig
+from .Trace import BuildTrace
+from .Utils import task_output_redirected, write_file_if_changed
+from .Variant import Variant
 
 
 class Project:
     _name: str
-    _targets = dict[str, Target]()
-    compile_config = BuildConfig(None)
-    link_config = BuildConfig(None)
+    _targets: dict[str, Target]
+    compile_config: BuildConfig
+    link_config: BuildConfig
 
     def __init__(self, name):
         logging.info(f"New project: {name}")
         self._name = name
+        self._targets = dict[str, Target]()
+        self.compile_config = BuildConfig(None)
+        self.link_config = BuildConfig(None)
+        self.unity_batch_size: int | None = None
+        # Linker used for all targets (passed to -fuse-ld), or None for the
+        # compiler's default.
+        self.linker: str | None = None
+        # Whether static libraries are created as thin archives.
+        self.thin_archives = False
+        # Maximum numbers of tasks performed at once, per resource pool.
+        self.pool_limits = dict[str, int]()
+        # Whether sources can use C++20 modules.
+        self.modules = False
+        # Tasks compiling C++ sources, by object file path.
+        self._compile_tasks = dict[str, Task]()
+        # Sources providing modules, by module name.
+        self._module_providers: dict[str, CppCompiledSource] | None = None
+        self._variants = dict[str, Variant]()
+        # Variant that this copy of the project is built as, or None if
+        # this is the project defined in build.py.
+        self.variant: Variant | None = None
+
+    # Links all targets with the given linker, e.g "lld", "mold" or "gold".
+    def set_linker(self, linker: str):
+        self.linker = linker
+
+    # Declares a variant of the project. If the project has variants, all
+    # of them (or the ones selected on the command line) are built at once,
+    # each into its own directory, instead of the project itself.
+    def add_variant(self, name: str) -> Variant:
+        if name in self._variants:
+            raise Exception(f"Variant {name} is already defined")
+        variant = Variant(name)
+        self._variants[name] = variant
+        return variant
+
+    # Returns copies of the project for all selected variants, or just the
+    # project if it has no variants. Generated targets are shared by the
+    # copies, because generators don't depend on compile options.
+    def variant_projects(self) -> list['Project']:
+        if not self._variants:
+            return [self]
+
+        names = config.variants or list(self._variants)
+        for name in names:
+            if name not in self._variants:
+                raise Exception(f"No variant with name {name} found")
+
+        projects = []
+        for name in names:
+            memo = {
+                id(target): target
+                for target in self._targets.values()
+                if isinstance(target, GeneratedTarget)
+            }
+            project = copy.deepcopy(self, memo)
+            project._variants = {}
+            project.variant = self._variants[name]
+            projects.append(project)
+        return projects
+
+    # Returns path of a file in the build directory of the project's
+    # variant.
+    def build_file(self, path: str):
+        if self.variant:
+            return config.build_file(os.path.join(self.variant.name, path))
+        return config.build_file(path)
+
+    # Returns path of a file in the tmp directory of the project's variant.
+    def tmp_file(self, path: str):
+        if self.variant:
+            return config.tmp_file(os.path.join(self.variant.name, path))
+        return config.tmp_file(path)
+
+    # Appended to names of tasks, so that tasks of different variants can
+    # be told apart.
+    def variant_suffix(self):
+        return f" [{self.variant.name}]" if self.variant else ""
+
+    # Options of the variant added after all other compile options.
+    def variant_compile_options(self) -> list[str]:
+        return self.variant.compile_config.build_arguments() if self.variant else []
+
+    # Options of the variant added after all other link options.
+    def variant_link_options(self) -> list[str]:
+        return self.variant.link_config.build_arguments() if self.variant else []
+
+    # Limits number of tasks of the given pool that are performed at once.
+    # Tasks are in the pool of their kind ("compile", "link", "generate")
+    # unless they are assigned to a custom pool. Limits given on the
+    # command line take precedence.
+    def set_pool_limit(self, pool: str, limit: int):
+        self.pool_limits[pool] = limit
+
+    # Returns pool limits from build.py and the command line.
+    def effective_pool_limits(self) -> dict[str, int]:
+        return {**self.pool_limits, **config.pool_limits}
+
+    # Creates static libraries as thin archives, which reference objects
+    # instead of copying them.
+    def set_thin_archives(self, thin_archives: bool = True):
+        self.thin_archives = thin_archives
+
+    # Enables unity build mode for all targets (unless disabled from the
+    # command line). See CppTarget.set_unity_build.
+    def set_unity_build(self, batch_size: int | None = None):
+        self.unity_batch_size = batch_size or config.unity_batch_size
+
+    # Enables C++20 modules for all targets (unless they disable them).
+    # Sources of these targets are scanned for module declarations and
+    # imports, and sources importing a module are compiled after the one
+    # providing it. A module must be provided by the importing target or a
+    # target that it links.
+    def set_modules(self, modules: bool = True):
+        self.modules = modules
+
+    def module_mapper_path(self):
+        return self.tmp_file("modules/mapper.txt")
+
+    def module_bmi_path(self, module: str):
+        return self.tmp_file(f"modules/{module.replace(':', '-')}.gcm")
+
+    def _get_module_providers(self) -> dict[str, CppCompiledSource]:
+        if self._module_providers is not None:
+            return self._module_providers
+
+        self._module_providers = {}
+        for target in self._targets.values():
+            if not isinstance(target, CppTarget) or not target.uses_modules():
+                continue
+            for src in target._get_build_units():
+                if not isinstance(src, CppCompiledSource) or not src.module_info().provides:
+                    continue
+                module = src.module_info().provides
+                provider = self._module_providers.setdefault(module, src)
+                # The same source compiled by multiple targets alike is
+                # compiled only once.
+                if provider.object_file_path() != src.object_file_path():
+                    raise Exception(f"Module {module} is provided by both {provider.path()} ({provider._target.name()}) and {src.path()} ({target.name()})")
+        return self._module_providers
+
+    # Returns sources providing modules that the source imports.
+    def module_dependencies(self, src: CppCompiledSource) -> list[CppCompiledSource]:
+        providers = self._get_module_providers()
+        dependencies = []
+        for module in src.module_info().requires:
+            provider = providers.get(module)
+            if not provider:
+                raise Exception(f"Module {module} imported by {src.path()} is not provided by any source")
+            if provider._target not in self.target_closure([src._target.name()]):
+                raise Exception(f"Module {module} imported by {src.path()} is provided by {provider._target.name()}, which {src._target.name()} doesn't link")
+            dependencies.append(provider)
+        return dependencies
+
+    # Writes the file that tells the compiler where BMIs of modules are.
+    def write_module_mapper(self):
+        providers = self._get_module_providers()
+        if providers:
+            write_file_if_changed(self.module_mapper_path(), "".join(
+                f"{module} {self.module_bmi_path(module)}\n"
+                for module in sorted(providers)))
 
     # Sources given as strings are assumed to be CppCompiledSources.
     def add_executable(self, name: str, *, sources: list[Union[str, Source]]):
@@ -41,40 +215,225 @@ class Project:
         self._targets[name] = target
         return target
 
-    def add_generated(self, name: str, *, generator: Callable[[list[str]],
-                                                              None],
-                      sources: list[str]):
+    # Sources given as strings are assumed to be CppCompiledSources.
+    def add_shared_library(self, name: str, *, sources: list[Union[str,
+                                                                   Source]]):
+        logging.info(
+            f"New shared library: {name}, compiled from {sources[:3]}...")
+        target = CppTarget(self,
+                           CppTargetType.SHARED_LIBRARY,
+                           name,
+                           sources=sources)
+        self._targets[name] = target
+        return target
+
+    # `outputs` are paths of generated files, relative to the build
+    # directory. The generator is run only if its sources, outputs or code
+    # changed, or if it doesn't declare outputs. Only the code of `generator`
+    # itself is tracked: changes to functions or globals that it uses don't
+    # make it run again.
+    def add_generated(self,
+                      name: str,
+                      *,
+                      generator: Callable[[list[str]], None],
+                      sources: list[str],
+                      outputs: list[str] = []):
         logging.info(
             f"New generated target: {name}, built from {sources[:3]}...")
-        target = GeneratedTarget(self, name, sources, generator)
+        target = GeneratedTarget(self, name, sources, generator, outputs)
         self._targets[name] = target
         return target
 
-    def build(self):
-        scheduler = TaskScheduler()
+    # Returns targets with the given names and all targets that they link
+    # (transitively), or all targets if `names` is None.
+    def target_closure(self, names: list[str] | None = None) -> list[Target]:
+        if names is None:
+            return list(self._targets.values())
+
+        closure = dict[Target, None]()
+        stack = list[Target]()
+        for name in names:
+            target = self._targets.get(name)
+            if not target:
+                raise Exception(f"No target with name {name} found")
+            stack.append(target)
+        while stack:
+            target = stack.pop()
+            if target in closure:
+                continue
+            closure[target] = None
+            stack += target.linked_targets()
+        return list(closure)
+
+    # Returns all files that the given targets (all targets by default) are
+    # built from, in all selected variants. Files that only a variant uses
+    # (e.g headers recorded for its objects) are known only to its copy of
+    # the project.
+    def input_files(self, targets: list[str] | None = None) -> set[str]:
+        return {
+            path
+            for project in self.variant_projects()
+            for target in project.target_closure(targets)
+            for path in target.input_files()
+        }
+
+    # Forgets tasks created by the previous build, so that the project can
+    # be built again.
+    def reset(self):
+        self._compile_tasks.clear()
+        self._module_providers = None
         for target in self._targets.values():
+            target.reset()
+
+    # Returns the task building the source. C++ sources compiled to the
+    # same object file, i.e the same source compiled with the same flags by
+    # multiple targets, share a single task.
+    def get_source_task(self, src: Source) -> Task:
+        if not isinstance(src, CppCompiledSource):
+            return src.get_task()
+        object_file_path = src.object_file_path()
+        task = self._compile_tasks.get(object_file_path)
+        if not task:
+            task = self._compile_tasks[object_file_path] = src.get_task()
+        return task
+
+    # Builds the given targets and everything they need, or all targets if
+    # `targets` is None. Returns False if some task failed.
+    def build(self, targets: list[str] | None = None) -> bool:
+        try:
+            return self._build(targets)
+        finally:
+            build_state.save()
+            object_cache.finish()
+            generator_pool.shutdown()
+
+    def _build(self, targets: list[str] | None) -> bool:
+        # Tasks of all variants are performed by a single scheduler, so that
+        # e.g compiles of one variant run while another one is linking.
+        projects = self.variant_projects()
+        closure = list(dict.fromkeys(
+            target
+            for project in projects
+            for target in project.target_closure(targets)))
+
+        # Hash all files that are known to be needed for up-to-date checks
+        # at once, on many threads.
+        build_state.ensure_loaded()
+        file_state.prefetch(
+            {path
+             for target in closure
+             for path in target.input_files()})
+
+        for project in projects:
+            project.write_module_mapper()
+
+        scheduler = TaskScheduler(self.effective_pool_limits())
+        for target in closure:
             for task in target.get_tasks():
                 scheduler.add_task(task)
 
         if logging.root.isEnabledFor(logging.DEBUG):
             scheduler.dump()
 
+        if config.dry_run:
+            self._print_plan(scheduler)
+            return True
+
+        trace = BuildTrace() if config.trace_file else None
+        throttle = create_load_throttle()
+        running = dict[Future, Task]()
+        failed_tasks = list[Task]()
+        # Unless keep-going mode is enabled, no new tasks are started after
+        # the first failure, but the running ones are finished.
+        stopping = False
+        with task_output_redirected(), create_executor(trace) as executor:
+            while True:
+                while not stopping and len(running) < executor.capacity() and throttle.can_start(len(running)):
+                    task = scheduler.get_next_task()
+                    if not task:
+                        break
+                    running[executor.submit(task)] = task
+
+                if not running:
+                    break
+
+                # If new tasks are throttled, the load needs to be checked
+                # again periodically even if no task finishes.
+                done, _ = wait(running,
+                               timeout=throttle.CHECK_INTERVAL_SECONDS if throttle.enabled() else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    output, error = future.result()
+                    print(f"\033[32;1mPerforming task:\033[m {task.name}")
+                    if config.explain and task.reason:
+                        print(f"    because {task.reason}")
+                    sys.stdout.write(output)
+                    if error:
+                        sys.stderr.write(error)
+                        scheduler.mark_as_failed(task)
+                        failed_tasks.append(task)
+                        stopping = not config.keep_going
+                    else:
+                        scheduler.mark_as_done(task)
+
+        if trace and config.trace_file:
+            trace.write(config.trace_file)
+            trace.print_summary()
+            print(f"\033[34;1mTrace written to:\033[m {config.trace_file}")
+
+        if failed_tasks:
+            self._print_failure_summary(failed_tasks, [
+                *scheduler.cancelled_tasks, *scheduler.remaining_tasks()
+            ])
+            return False
+        return True
+
+    # Prints tasks that would be performed, in an order in which they could
+    # be performed. Some of them may turn out to be up to date when they are
+    # actually performed, e.g sources that are checked again only because
+    # the PCH is rebuilt.
+    def _print_plan(self, scheduler: TaskScheduler):
+        tasks = list[Task]()
         while True:
             task = scheduler.get_next_task()
             if not task:
                 break
-            try:
-                print(f"\033[32;1mPerforming task:\033[m {task.name}")
-                task.worker()
-            except Exception:
-                traceback.print_exc()
-            finally:
-                scheduler.mark_as_done(task)
-
-    def run(self, target_name):
-        print(f"\033[34;1mRunning target:\033[m {target_name}")
+            scheduler.mark_as_done(task)
+            tasks.append(task)
+        print(f"\033[34;1mWould perform {len(tasks)} tasks:\033[m")
+        for task in tasks:
+            print(f"  {task.name}")
+            if config.explain and task.reason:
+                print(f"    because {task.reason}")
+
+    def _print_failure_summary(self, failed_tasks: list[Task],
+                               skipped_tasks: list[Task]):
+        # Skipped tasks may be numerous, so only some of them are listed.
+        max_listed_skipped_tasks = 10
+        print(f"\033[31;1mBuild failed:\033[m {len(failed_tasks)} failed, "
+              f"{len(skipped_tasks)} skipped")
+        for task in failed_tasks:
+            print(f"  failed:  {task.name}")
+        for task in skipped_tasks[:max_listed_skipped_tasks]:
+            print(f"  skipped: {task.name}")
+        if len(skipped_tasks) > max_listed_skipped_tasks:
+            print(f"  ... and {len(skipped_tasks) - max_listed_skipped_tasks} more skipped")
+
+    # Runs generator of the given GeneratedTarget. This is used by build
+    # files generated for other build systems.
+    def run_generator(self, target_name):
         target = self._targets.get(target_name)
+        if not isinstance(target, GeneratedTarget):
+            raise Exception(f"No generated target with name {target_name} found")
+        target.run_generator()
+
+    # Runs the target (of the first selected variant, if the project has
+    # variants) and returns its exit code.
+    def run(self, target_name) -> int:
+        print(f"\033[34;1mRunning target:\033[m {target_name}")
+        target = self.variant_projects()[0]._targets.get(target_name)
         if not target:
             raise Exception(f"No target with name {target_name} found")
 
-        target.run()
+        return target.run()
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import re
+import socket
+import socketserver
+import struct
+import subprocess as sp
+import tempfile
+import threading
+import time
+
+from .Utils import CommandError, CommandResult, CommandStats, record_command_stats
+
+# Protocol: the client sends a JSON header frame followed by a frame with
+# preprocessed source, and the worker responds with a JSON header frame
+# followed by a frame with the object file (empty if compilation failed).
+# Every frame is prefixed with its length as a big-endian 64-bit integer.
+PROTOCOL_VERSION = 1
+_FRAME_LENGTH = struct.Struct(">Q")
+
+# Options that make no sense for preprocessed input, and are therefore not
+# sent to workers. The ones in the first set take a value as the next
+# argument.
+_PREPROCESSOR_OPTIONS_WITH_VALUE = {
+    "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-MF", "-MT",
+    "-MQ"
+}
+_PREPROCESSOR_OPTION_PREFIXES = ("-I", "-D", "-U", "-M", "-Winvalid-pch")
+
+# Options that workers accept. Anything else (e.g -x, -include, -I, or
+# input files) could make the compiler read or write arbitrary files or run
+# arbitrary programs, so requests containing it are rejected.
+_ALLOWED_OPTIONS = {"-w", "-pedantic", "-pedantic-errors", "-ansi", "-pthread", "-p", "-pg"}
+_ALLOWED_OPTION_PREFIXES = ("-std=", "-O", "-g", "-W", "-f", "-m")
+# Allowed prefixes cover some options that still access files or run
+# programs, so these are rejected explicitly.
+_FORBIDDEN_OPTION_PREFIXES = (
+    "-Wa,", "-Wl,", "-Wp,", "-fmodule-mapper", "-fmodules-ts", "-fplugin",
+    "-fdump", "-fprofile", "-fauto-profile", "-fopt-info", "-fdeps",
+    "-fcallgraph-info", "-fsave-optimization-record", "-fsanitize-blacklist",
+    "-fsanitize-ignorelist", "-fsanitize-coverage-allowlist",
+    "-fsanitize-coverage-ignorelist", "-fltrans", "-fresolution", "-fwpa",
+    "-fself-test", "-fcompare-debug", "-fstack-usage")
+# Values of allowed options (after "=") must not be paths.
+_SAFE_OPTION_VALUE = re.compile(r"[\w.,+=-]*")
+
+
+def _is_allowed_option(arg: str) -> bool:
+    if arg in _ALLOWED_OPTIONS:
+        return True
+    if not arg.startswith(_ALLOWED_OPTION_PREFIXES) or arg.startswith(_FORBIDDEN_OPTION_PREFIXES):
+        return False
+    _, _, value = arg.partition("=")
+    return _SAFE_OPTION_VALUE.fullmatch(value) is not None and ".." not in value
+
+
+# Returns arguments that workers refuse to compile with.
+def forbidden_remote_options(arguments: list[str]) -> list[str]:
+    return [arg for arg in arguments if not _is_allowed_option(arg)]
+
+
+class NoWorkerAvailable(Exception):
+    pass
+
+
+def _send_frame(connection: socket.socket, data: bytes):
+    connection.sendall(_FRAME_LENGTH.pack(len(data)) + data)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed unexpectedly")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _receive_frame(connection: socket.socket) -> bytes:
+    (size, ) = _FRAME_LENGTH.unpack(
+        _receive_exactly(connection, _FRAME_LENGTH.size))
+    return _receive_exactly(connection, size)
+
+
+# Returns compiler arguments that are needed to compile an already
+# preprocessed source.
+def remote_compile_arguments(arguments: list[str]) -> list[str]:
+    result = []
+    skip_value = False
+    for arg in arguments:
+        if skip_value:
+            skip_value = False
+        elif arg in _PREPROCESSOR_OPTIONS_WITH_VALUE:
+            skip_value = True
+        elif not arg.startswith(_PREPROCESSOR_OPTION_PREFIXES):
+            result.append(arg)
+    return result
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+
+class RemoteCompileClient:
+    # Sends compile jobs to worker daemons. At most `window` jobs are in
+    # flight at once. Workers that can't be connected to are skipped for
+    # RETRY_SECONDS; if there are none left, NoWorkerAvailable is raised so
+    # that the job can be performed locally.
+
+    RETRY_SECONDS = 30
+    TIMEOUT_SECONDS = 600
+
+    def __init__(self, workers: list[str], window: int):
+        self._workers = [parse_address(worker) for worker in workers]
+        self._window = threading.Semaphore(max(window, 1))
+        self._lock = threading.Lock()
+        self._next_worker = 0
+        # Time until which a worker is considered unavailable.
+        self._unavailable_until = dict[tuple[str, int], float]()
+
+    def available(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                self._unavailable_until.get(worker, 0) <= now
+                for worker in self._workers)
+
+    # Returns workers in the order they should be tried in.
+    def _candidates(self) -> list[tuple[str, int]]:
+        now = time.monotonic()
+        with self._lock:
+            start = self._next_worker
+            self._next_worker = (self._next_worker + 1) % len(self._workers)
+            return [
+                worker
+                for worker in self._workers[start:] + self._workers[:start]
+                if self._unavailable_until.get(worker, 0) <= now
+            ]
+
+    def _mark_unavailable(self, worker: tuple[str, int]):
+        logging.warning(f"Remote worker {worker[0]}:{worker[1]} is unavailable")
+        with self._lock:
+            self._unavailable_until[worker] = time.monotonic(
+            ) + self.RETRY_SECONDS
+
+    # Compiles the preprocessed source with `arguments` on some worker and
+    # writes the object file to `object_path`. Raises CommandError if the
+    # compilation fails.
+    def compile(self, preprocessed_path: str, arguments: list[str],
+                object_path: str) -> CommandResult:
+        arguments = remote_compile_arguments(arguments)
+        with open(preprocessed_path, "rb") as f:
+            preprocessed = f.read()
+        header = json.dumps({
+            "version": PROTOCOL_VERSION,
+            "arguments": arguments
+        }).encode()
+
+        with self._window:
+            for worker in self._candidates():
+                start = time.perf_counter()
+                try:
+                    with socket.create_connection(
+                            worker, timeout=self.TIMEOUT_SECONDS) as connection:
+                        _send_frame(connection, header)
+                        _send_frame(connection, preprocessed)
+                        response = json.loads(_receive_frame(connection))
+                        object_data = _receive_frame(connection)
+                except (OSError, ValueError):
+                    self._mark_unavailable(worker)
+                    continue
+                break
+            else:
+                raise NoWorkerAvailable()
+
+        command = ["g++", "-c", preprocessed_path, *arguments]
+        result = CommandResult(command, response["returncode"],
+                               response["output"])
+        record_command_stats(
+            CommandStats(f"[{worker[0]}:{worker[1]}] {result.command()}",
+                         time.perf_counter() - start,
+                         response.get("cpu_time", 0),
+                         response.get("max_rss_kb", 0), result.returncode))
+        print(result.output, end="")
+        if result.returncode != 0:
+            raise CommandError(result)
+
+        temporary_path = f"{object_path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(object_data)
+        os.replace(temporary_path, object_path)
+        return result
+
+
+class _WorkerRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server: WorkerServer = self.server  # type: ignore
+        try:
+            header = json.loads(_receive_frame(self.request))
+            preprocessed = _receive_frame(self.request)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Invalid request from {self.client_address}: {e}")
+            return
+
+        with server.slots:
+            response, object_data = server.compile(header, preprocessed)
+        _send_frame(self.request, json.dumps(response).encode())
+        _send_frame(self.request, object_data)
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    # Worker daemon compiling preprocessed sources sent by
+    # RemoteCompileClient, at most `jobs` at once. It runs the compiler with
+    # arguments sent by clients, so it must only be reachable by trusted
+    # machines.
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], jobs: int):
+        super().__init__(address, _WorkerRequestHandler)
+        self.slots = threading.Semaphore(max(jobs, 1))
+
+    def compile(self, header: dict, preprocessed: bytes) -> tuple[dict, bytes]:
+        if header.get("version") != PROTOCOL_VERSION:
+            return {
+                "returncode": 1,
+                "output": f"Unsupported protocol version {header.get('version')}\n"
+            }, b""
+        arguments: list[str] = header["arguments"]
+        forbidden = forbidden_remote_options(arguments)
+        if forbidden:
+            return {
+                "returncode": 1,
+                "output": f"Forbidden options: {' '.join(forbidden)}\n"
+            }, b""
+
+        with tempfile.TemporaryDirectory(prefix="essabuild-worker-") as directory:
+            source_path = os.path.join(directory, "source.ii")
+            object_path = os.path.join(directory, "source.o")
+            with open(source_path, "wb") as f:
+                f.write(preprocessed)
+            process = sp.Popen(
+                ["g++", "-c", source_path, "-o", object_path, *arguments],
+                stdin=sp.DEVNULL,
+                stdout=sp.PIPE,
+                stderr=sp.STDOUT,
+                cwd=directory)
+            assert process.stdout
+            output = process.stdout.read().decode(errors="replace")
+            process.stdout.close()
+            _, status, rusage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+
+            object_data = b""
+            if returncode == 0:
+                with open(object_path, "rb") as f:
+                    object_data = f.read()
+        return {
+            "returncode": returncode,
+            "output": output,
+            "cpu_time": rusage.ru_utime + rusage.ru_stime,
+            "max_rss_kb": rusage.ru_maxrss,
+        }, object_data
+
+
+def run_worker(address: str, jobs: int):
+    with WorkerServer(parse_address(address), jobs) as server:
+        host, port = server.server_address[:2]
+        print(f"\033[34;1mWorker listening on\033[m {host}:{port} "
+              f"({jobs} jobs)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
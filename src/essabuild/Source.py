@@ -3,37 +3,57 @@ import hashlib
 import os
 
 from .BuildConfig import BuildConfig
+from .BuildState import build_state
 from .Config import config
+from .FileState import file_state
+from .Modules import ModuleInfo, scan_module_declarations
+from .ObjectCache import object_cache
+from .Remote import forbidden_remote_options, remote_compile_arguments
 from .Utils import *
 from .TaskScheduler import Task
+from .UpToDate import UpToDate, check, out_of_date, up_to_date
 
 from typing import TYPE_CHECKING, Callable
 if TYPE_CHECKING:
+    from .Remote import RemoteCompileClient
     from .Target import CppTarget
 
 
-def hash_path(path):
-    return config.tmp_file(f"hash_{hashlib.md5(path.encode()).hexdigest()}")
-
-
-def calculate_file_hash(path):
-    with open(path, "rb") as f:
-        # TODO: This file should be preprocessed so that it handles headers properly.
-        return hashlib.md5(f.read()).hexdigest()
-
-
-def file_didnt_change(path):
-    try:
-        with open(hash_path(path)) as f:
-            old_hash = f.read()
-    except FileNotFoundError:
-        old_hash = None
-
-    new_hash = calculate_file_hash(path)
-    return new_hash == old_hash
+def file_didnt_change(path, command: str | None = None) -> UpToDate:
+    return build_state.inputs_didnt_change(path, command)
+
+
+# Parses a Makefile-style dependency file generated by the compiler (-MMD)
+# and returns paths to all prerequisites of its first rule. Other rules
+# describe modules (with -fmodules-ts) and are ignored.
+def parse_depfile(path) -> list[str]:
+    with open(path) as f:
+        content = f.read().replace("\\\n", " ")
+    rule, _, _ = content.partition("\n")
+    _, _, prerequisites = rule.partition(": ")
+    dependencies = list[str]()
+    current = ""
+    escaped = False
+    for char in prerequisites:
+        if escaped:
+            current += char if char in " #" else "\\" + char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char.isspace():
+            if current:
+                dependencies.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        dependencies.append(current)
+    return dependencies
 
 
 class Source(abc.ABC):
+    # Kind of the task building the source.
+    task_kind = "compile"
 
     @abc.abstractmethod
     def build(self):
@@ -43,10 +63,32 @@ class Source(abc.ABC):
     def get_build_description(self) -> str:
         return
 
+    # Returns whether the source is up to date, and if not, why.
     @abc.abstractmethod
-    def is_up_to_date(self) -> bool:
+    def is_up_to_date(self) -> UpToDate:
         return
 
+    # Returns name of the source used in messages.
+    def name(self) -> str:
+        return self.get_build_description()
+
+    # Whether the source can be built by a RemoteCompileClient.
+    remote_buildable = False
+
+    # Returns files that the source is built from, as known so far.
+    def input_files(self) -> list[str]:
+        return []
+
+    # Forgets state of the previous build.
+    def reset(self):
+        pass
+
+    # Builds the source using a RemoteCompileClient. It may raise
+    # NoWorkerAvailable, in which case the source is built locally instead.
+    # Sources that are not remote_buildable are always built locally.
+    def build_remotely(self, client: 'RemoteCompileClient'):
+        self.build()
+
     def get_task(self):
 
         def worker():
@@ -56,7 +98,17 @@ class Source(abc.ABC):
                 return
             self.build()
 
-        return Task(self.get_build_description(), worker, [])
+        def remote_worker(client: 'RemoteCompileClient'):
+            nonlocal self
+            print(f"... {self.get_build_description()}")
+            if self.is_up_to_date():
+                return
+            self.build_remotely(client)
+
+        return Task(self.get_build_description(),
+                    worker, [],
+                    kind=self.task_kind,
+                    remote_worker=remote_worker if self.remote_buildable else None)
 
 
 class CppCompiledSource(Source):
@@ -65,51 +117,306 @@ class CppCompiledSource(Source):
 
     def __init__(self, path, target: 'CppTarget'):
         self._path = path
+        self._target = target
         self.config = BuildConfig(target.compile_config)
-
+        # Whether the source can be compiled as a part of a unity batch.
+        self.unity_build = True
+        self._module_info: ModuleInfo | None = None
+
+    # Sources using modules need BMIs of the modules they import, which
+    # remote workers don't have. Sources with options that workers refuse
+    # are compiled locally as well.
+    @property
+    def remote_buildable(self):
+        return not self._target.uses_modules() and \
+            not forbidden_remote_options(remote_compile_arguments(self.compile_arguments()))
+
+    def source_file_path(self):
+        return config.source_file(self._path)
+
+    # Objects of the source compiled with different flags (e.g by different
+    # targets) are stored in separate files, so that they don't overwrite
+    # each other.
     def object_file_path(self):
-        return f"{config.build_file(self._path)}.o"
+        return f"{self._target._project.build_file(self._path)}.{self.flags_hash()}.o"
+
+    def flags_hash(self):
+        return hashlib.md5(self.command_line().encode()).hexdigest()[:12]
+
+    def depfile_path(self):
+        return f"{self.object_file_path()}.d"
+
+    # Returns modules that the source provides and requires. Sources are
+    # scanned only if modules are enabled for their target. Sources that
+    # don't exist yet (e.g because they are generated) are assumed not to
+    # declare any modules.
+    def module_info(self) -> ModuleInfo:
+        if self._module_info is None:
+            self._module_info = ModuleInfo(None, [])
+            if self._target.uses_modules():
+                try:
+                    self._module_info = scan_module_declarations(self.source_file_path())
+                except FileNotFoundError:
+                    pass
+        return self._module_info
+
+    # Returns path of the BMI that the source produces, if any.
+    def bmi_path(self) -> str | None:
+        provides = self.module_info().provides
+        return self._target._project.module_bmi_path(provides) if provides else None
+
+    # Returns paths of BMIs that are needed to compile the source.
+    def required_bmi_paths(self) -> list[str]:
+        return [self._target._project.module_bmi_path(name) for name in self.module_info().requires]
+
+    def reset(self):
+        self._module_info = None
+
+    # Compile options, including the ones that are not configurable by the
+    # user.
+    def compile_arguments(self) -> list[str]:
+        arguments = self.config.build_arguments() + self._target.implicit_compile_options()
+        pch = self._target.precompiled_header
+        if pch:
+            arguments += pch.include_arguments()
+        return arguments
+
+    def command_line(self):
+        return shlex.join(self.compile_arguments())
 
     def build(self):
-        sprun(f"""g++
-        -c {config.source_file(self._path)}
-        -o {self.object_file_path()}
-        {self.config.build_command_line()}
-        """)
-
-        with open(hash_path(self._path), "w") as f:
-            f.write(calculate_file_hash(self._path))
+        self._build(None)
+
+    def build_remotely(self, client: 'RemoteCompileClient'):
+        self._build(client)
+
+    def _build(self, client: 'RemoteCompileClient | None'):
+        # Preprocessed source is needed for the object cache key, and is
+        # what is sent to remote workers. Objects of sources using modules
+        # are not cached, because the key would not include the BMIs they
+        # depend on.
+        use_cache = object_cache.enabled() and not self._target.uses_modules()
+        preprocessed_path = None
+        if use_cache or client:
+            preprocessed_path = self._preprocess()
+        try:
+            cache_key = None
+            if use_cache:
+                assert preprocessed_path
+                cache_key = object_cache.key(preprocessed_path,
+                                             self.command_line(), "g++")
+                if object_cache.fetch(cache_key, self.object_file_path()):
+                    self._record_build()
+                    return
+                # The object may be a hard link to a cache entry, so make
+                # sure that the compiler doesn't overwrite it in place.
+                if os.path.exists(self.object_file_path()):
+                    os.remove(self.object_file_path())
+
+            os.makedirs(os.path.dirname(self.object_file_path()), exist_ok=True)
+            if client:
+                assert preprocessed_path
+                client.compile(preprocessed_path, self.compile_arguments(),
+                               self.object_file_path())
+            else:
+                run_command([
+                    "g++", "-c", self.source_file_path(),
+                    "-o", self.object_file_path(),
+                    "-MMD", "-MF", self.depfile_path(),
+                    *self.compile_arguments()
+                ])
+        finally:
+            if preprocessed_path:
+                os.remove(preprocessed_path)
+
+        if cache_key:
+            object_cache.store(cache_key, self.object_file_path())
+        self._record_build()
+
+    # Preprocesses the source (which also generates the depfile) and
+    # returns path to the preprocessed file.
+    def _preprocess(self):
+        preprocessed_path = f"{self.object_file_path()}.ii"
+        os.makedirs(os.path.dirname(preprocessed_path), exist_ok=True)
+        run_command([
+            "g++", "-E", self.source_file_path(),
+            "-o", preprocessed_path,
+            "-MMD", "-MF", self.depfile_path(), "-MT", self.object_file_path(),
+            *self.compile_arguments()
+        ])
+        return preprocessed_path
+
+    def _record_build(self):
+        # The depfile lists the source itself and all (non-system) headers
+        # that it includes. Headers included through a precompiled header
+        # are not listed, so the PCH itself is tracked instead. BMIs of
+        # imported modules are tracked as well, so that the source is
+        # rebuilt only if some of them actually changed.
+        inputs = parse_depfile(self.depfile_path()) + self.required_bmi_paths()
+        pch = self._target.precompiled_header
+        if pch:
+            inputs.append(pch.gch_path())
+        bmi_path = self.bmi_path()
+        build_state.record(self.object_file_path(),
+                           inputs=inputs,
+                           outputs=[self.object_file_path(), *([bmi_path] if bmi_path else [])],
+                           command=self.command_line())
 
     def get_build_description(self):
-        return f"build source: {self._path}"
+        return f"build source: {self._path}{self._target._project.variant_suffix()}"
+
+    def input_files(self):
+        return [
+            self.source_file_path(),
+            *(build_state.recorded_inputs(self.object_file_path()) or {})
+        ]
 
     def is_up_to_date(self):
         # Source file is up to date if:
-        # 1. Object file exists
+        # 1. Object file (and BMI, if the source provides a module) exists
+        #    (objects are stored per flags, so it doesn't exist if the
+        #    flags changed)
         if not os.path.exists(self.object_file_path()):
-            return False
+            return out_of_date("there is no object file built with the current flags")
+        bmi_path = self.bmi_path()
+        if bmi_path and not os.path.exists(bmi_path):
+            return out_of_date("BMI is missing")
 
-        # 2. File hash didn't change since last build
-        return file_didnt_change(self._path)
+        # 2. Hashes of the file and all headers it includes didn't change
+        #    since last build, and it was built with the same flags
+        return file_didnt_change(self.object_file_path(), self.command_line())
 
     def path(self):
         return self._path
 
+    def name(self):
+        return self._path
+
+
+class UnityBatchSource(CppCompiledSource):
+    # Generated source that includes a batch of sources of a target, so that
+    # headers shared by them are parsed only once.
+
+    def __init__(self, index: int, sources: list[CppCompiledSource],
+                 target: 'CppTarget'):
+        super().__init__(f"unity/{target.name()}/batch{index}.cpp", target)
+        self._sources = sources
+
+    def source_file_path(self):
+        return self._target._project.tmp_file(self._path)
+
+    def object_file_path(self):
+        return f"{self._target._project.tmp_file(self._path)}.o"
+
+    def write(self):
+        write_file_if_changed(
+            self.source_file_path(), "".join([
+                f"#include \"{src.source_file_path()}\"\n"
+                for src in self._sources
+            ]))
+
+    def get_build_description(self):
+        return f"build unity batch: {self._path} ({len(self._sources)} sources){self._target._project.variant_suffix()}"
+
+
+class PrecompiledHeader(Source):
+    # The header is precompiled through a wrapper header in the tmp
+    # directory, so that the .gch file can be stored next to it (which is
+    # where GCC looks for it) without polluting the source directory.
+
+    def __init__(self, path, target: 'CppTarget'):
+        self._path = path
+        self._target = target
+
+    def wrapper_path(self):
+        return self._target._project.tmp_file(
+            f"pch/{self._target.name()}/{os.path.basename(self._path)}")
+
+    def gch_path(self):
+        return f"{self.wrapper_path()}.gch"
+
+    def depfile_path(self):
+        return f"{self.gch_path()}.d"
+
+    def include_arguments(self):
+        return ["-include", self.wrapper_path(), "-Winvalid-pch"]
+
+    # The PCH must be built with exactly the same options as the sources
+    # of the target, otherwise it is ignored.
+    def compile_arguments(self) -> list[str]:
+        return self._target.compile_config.build_arguments() + self._target.implicit_compile_options()
+
+    def command_line(self):
+        return shlex.join(self.compile_arguments())
+
+    def write_wrapper(self):
+        write_file_if_changed(self.wrapper_path(),
+                              f"#include \"{config.source_file(self._path)}\"\n")
+
+    def build(self):
+        self.write_wrapper()
+
+        run_command([
+            "g++", "-x", "c++-header", self.wrapper_path(),
+            "-o", self.gch_path(),
+            "-MMD", "-MF", self.depfile_path(),
+            *self.compile_arguments()
+        ])
+
+        build_state.record(self.gch_path(),
+                           inputs=parse_depfile(self.depfile_path()),
+                           outputs=[self.gch_path()],
+                           command=self.command_line())
+
+    def get_build_description(self):
+        return f"precompile header: {self._path}{self._target._project.variant_suffix()}"
+
+    def name(self):
+        return self._path
+
+    def input_files(self):
+        return [
+            config.source_file(self._path),
+            *(build_state.recorded_inputs(self.gch_path()) or {})
+        ]
+
+    def is_up_to_date(self):
+        # PCH is up to date if it exists and its header closure and flags
+        # didn't change since last build.
+        return check(os.path.exists(self.gch_path()), "precompiled header is missing") and \
+            file_didnt_change(self.gch_path(), self.command_line())
+
 
 class GeneratedSource(Source):
+    task_kind = "generate"
 
     def __init__(self, generator: Callable[['GeneratedSource'], None],
                  sources: list[str]):
         self._sources = sources
         self._generator = generator
 
+    def _state_key(self):
+        return f"generated source:{shlex.join(self._sources)}"
+
     def build(self):
-        self._generator
+        self._generator(self)
+        # We don't know which files the generator wrote.
+        file_state.invalidate()
+        build_state.record(self._state_key(),
+                           inputs=self.input_files(),
+                           command=function_code_hash(self._generator))
 
     def get_build_description(self) -> str:
         return f"Source generated from {self._sources}"
 
-    def is_up_to_date(self) -> bool:
-        # 1. Underlying source file is up to date
-        # 2. All files are
-        return all([file_didnt_change(f) for f in self._sources])
+    def input_files(self):
+        return [config.source_file(path) for path in self._sources]
+
+    def is_up_to_date(self) -> UpToDate:
+        # Up to date if the sources and the generator code didn't change
+        # since the generator was run.
+        command = function_code_hash(self._generator)
+        if command is None:
+            return out_of_date("generator code can't be hashed")
+        return build_state.inputs_didnt_change(self._state_key(), command,
+                                               "generator code")
@@ -1,10 +1,15 @@
 from enum import IntEnum
 import os
+import shlex
 
 from .BuildConfig import BuildConfig
 from .Config import config
-from .Source import Source, CppCompiledSource
+from .BuildState import build_state, display_path
+from .FileState import calculate_file_hash, file_state
+from .GeneratorPool import generator_pool
+from .Source import Source, CppCompiledSource, PrecompiledHeader, UnityBatchSource
 from .TaskScheduler import Task
+from .UpToDate import UpToDate, check, out_of_date, up_to_date
 from .Utils import *
 
 import abc
@@ -34,15 +39,25 @@ class Target(abc.ABC):
         return
 
     @abc.abstractmethod
-    def is_linking_up_to_date(self) -> bool:
+    def is_linking_up_to_date(self) -> UpToDate:
         return
 
-    def run(self):
+    # Returns files that the target is built from, as known so far.
+    def input_files(self) -> list[str]:
+        return []
+
+    # Forgets tasks and state of the previous build.
+    def reset(self):
+        pass
+
+    # Runs the target and returns its exit code.
+    def run(self) -> int:
         raise Exception(f"Target '{self.name}' is not runnable")
 
 class CppTargetType(IntEnum):
     EXECUTABLE = 1
     STATIC_LIBRARY = 2
+    SHARED_LIBRARY = 3
 
 class CppTarget(Target):
     target_type: CppTargetType
@@ -59,108 +74,517 @@ class CppTarget(Target):
         if self.source_tasks:
             return self.source_tasks
 
-        self.source_tasks = [src.get_task() for src in self.sources if not src.is_up_to_date()]
+        pch_task = self._get_pch_task()
+        generate_tasks = self._get_generate_tasks()
+        rebuilt_sources = [src for src in self._get_build_units() if not self._source_is_up_to_date(src)]
+        self.source_tasks = [self._project.get_source_task(src) for src in rebuilt_sources]
+
+        # Sources may include files produced by linked generators, so they
+        # can be compiled only after generation is finished. Similarly,
+        # sources importing modules can be compiled only after BMIs of the
+        # modules are.
+        for src, task in zip(rebuilt_sources, self.source_tasks):
+            # The task may be shared with another target, which already
+            # explained it.
+            task.reason = task.reason or self._source_is_up_to_date(src).reason
+            task.dependencies.extend(generate_tasks)
+            if pch_task:
+                task.dependencies.append(pch_task)
+            if isinstance(src, CppCompiledSource):
+                task.dependencies.extend(self._project.get_source_task(dep) for dep in self._project.module_dependencies(src) if not dep._target._source_is_up_to_date(dep))
         return self.source_tasks
 
+    # Checks whether the source can be skipped in this build. Otherwise, it
+    # is checked again (and rebuilt if it is not up to date then) during the
+    # build. This is the case if it is not up to date now, or if the PCH is
+    # rebuilt, a linked generator is run, or a module it imports is rebuilt,
+    # because it may depend on them.
+    def _source_is_up_to_date(self, src: Source) -> UpToDate:
+        if src in self._sources_up_to_date:
+            return self._sources_up_to_date[src]
+        # Modules can't import each other circularly, but if they do anyway,
+        # this stops the recursion. The scheduler reports the cycle then.
+        self._sources_up_to_date[src] = up_to_date
+        result = \
+            check(not self._get_pch_task(), "precompiled header is rebuilt") and \
+            self._generators_are_up_to_date() and \
+            src.is_up_to_date() and \
+            self._imported_modules_are_up_to_date(src)
+        self._sources_up_to_date[src] = result
+        return result
+
+    def _generators_are_up_to_date(self) -> UpToDate:
+        for lib in self._linked_targets:
+            if isinstance(lib, GeneratedTarget) and lib._get_generate_task():
+                return out_of_date(f"generated target {lib.name()} is regenerated")
+        return up_to_date
+
+    def _imported_modules_are_up_to_date(self, src: Source) -> UpToDate:
+        if not isinstance(src, CppCompiledSource):
+            return up_to_date
+        for dep in self._project.module_dependencies(src):
+            if not dep._target._source_is_up_to_date(dep):
+                return out_of_date(f"imported module {dep.module_info().provides} is rebuilt")
+        return up_to_date
+
+    def _unity_batch_size(self):
+        if config.unity_build is False:
+            return None
+        batch_size = self.unity_batch_size or self._project.unity_batch_size
+        if not batch_size and config.unity_build:
+            batch_size = config.unity_batch_size
+        return batch_size
+
+    # Returns sources that are actually compiled. In unity build mode, these
+    # are batches of the target's sources, and sources that are compiled
+    # alone.
+    def _get_build_units(self):
+        if self.build_units is not None:
+            return self.build_units
+
+        batch_size = self._unity_batch_size()
+        if not batch_size or batch_size < 2:
+            self.build_units = self.sources
+            return self.build_units
+
+        # Sources with their own compile options, and module units, must be
+        # compiled alone.
+        def can_be_batched(src: Source):
+            return isinstance(src, CppCompiledSource) and src.unity_build and \
+                src.config.build_arguments() == self.compile_config.build_arguments() and \
+                not src.module_info().declares_modules()
+
+        batched_sources = [src for src in self.sources if can_be_batched(src)]
+        self.build_units = [src for src in self.sources if not can_be_batched(src)]
+        for index in range(0, len(batched_sources), batch_size):
+            batch = cast(list[CppCompiledSource], batched_sources[index:index + batch_size])
+            if len(batch) == 1:
+                self.build_units += batch
+                continue
+            unity_source = UnityBatchSource(index // batch_size, batch, self)
+            unity_source.write()
+            self.build_units.append(unity_source)
+        return self.build_units
+
+    def _get_generate_tasks(self):
+        tasks = [lib._get_generate_task() for lib in self._linked_targets if isinstance(lib, GeneratedTarget)]
+        return [task for task in tasks if task]
+
+    def _get_pch_task(self):
+        if self.pch_task or not self.precompiled_header:
+            return self.pch_task
+
+        result = self.precompiled_header.is_up_to_date()
+        if not result:
+            self.pch_task = self.precompiled_header.get_task()
+            self.pch_task.reason = result.reason
+            self.pch_task.dependencies.extend(self._get_generate_tasks())
+        return self.pch_task
+
+    # Returns all libraries that the target needs. Static libraries don't
+    # include libraries they link, so these are also linked (transitively)
+    # to targets that link the static library.
+    def _linked_libraries(self) -> list['CppTarget']:
+        libraries = []
+        for lib in self._linked_targets:
+            if not isinstance(lib, CppTarget):
+                continue
+            libraries.append(lib)
+            if lib.target_type == CppTargetType.STATIC_LIBRARY:
+                libraries += lib._linked_libraries()
+
+        # If a library is needed more than once, it must be linked after
+        # everything that needs it.
+        return list(reversed(dict.fromkeys(reversed(libraries))))
+
+    # Returns link options of all libraries that the target needs.
+    def _library_link_options(self) -> list[str]:
+        return [arg for lib in self._linked_libraries() for arg in lib.get_link_option()]
+
+    # Returns files whose content matters for targets linking this one. A
+    # thin archive only references its objects, so they matter as well.
+    def link_artifacts(self) -> list[str]:
+        if self.target_type == CppTargetType.STATIC_LIBRARY and self._is_thin_archive():
+            return [self.executable_path(), *self._object_file_paths()]
+        return [self.executable_path()]
+
+    def _object_file_paths(self):
+        # FIXME: This is not abstract enough.
+        return [src.object_file_path() for src in self._get_build_units() if isinstance(src, CppCompiledSource)]
+
+    # Returns all files that the linker (or archiver) reads. An archive
+    # contains only its own objects, even though libraries that it links
+    # are linked to its users.
+    def _link_inputs(self):
+        if self.target_type == CppTargetType.STATIC_LIBRARY:
+            return self._object_file_paths()
+        return [*self._object_file_paths(), *[path for lib in self._linked_libraries() for path in lib.link_artifacts()]]
+
+    def _link_arguments(self) -> list[str]:
+        objects = self._object_file_paths()
+        linker = self.linker or self._project.linker
+        linker_arguments = [f"-fuse-ld={linker}"] if linker else []
+        match self.target_type:
+            case CppTargetType.EXECUTABLE:
+                return [
+                    "g++",
+                    "-o", self.executable_path(),
+                    *objects,
+                    *self._library_link_options(),
+                    *linker_arguments,
+                    *self.link_arguments()
+                ]
+            case CppTargetType.SHARED_LIBRARY:
+                return [
+                    "g++",
+                    "-shared",
+                    "-o", self.executable_path(),
+                    f"-Wl,-soname,{os.path.basename(self.executable_path())}",
+                    *objects,
+                    *self._library_link_options(),
+                    *linker_arguments,
+                    *self.link_arguments()
+                ]
+            case CppTargetType.STATIC_LIBRARY:
+                # Libraries linked to a static library are linked to its
+                # users instead.
+                return [
+                    "ar", "-rcs", *(["--thin"] if self._is_thin_archive() else []),
+                    self.executable_path(),
+                    *objects
+                ]
+
+    # Checks that the output exists, wasn't modified, and was linked with
+    # the same command from the same inputs as now. This is checked again
+    # right before linking, so that if rebuilt objects or libraries turned
+    # out to be identical to the previous ones, linking (and linking of
+    # everything depending on the output) is skipped.
+    def _link_output_didnt_change(self) -> UpToDate:
+        return check(os.path.exists(self.executable_path()), f"{display_path(self.executable_path())} is missing") and \
+            build_state.inputs_didnt_change(self.executable_path(), shlex.join(self._link_arguments()), "link command") and \
+            build_state.outputs_didnt_change(self.executable_path())
+
+    # Updates the archive in place, replacing only objects that changed and
+    # removing objects that are no longer a part of the target. Members are
+    # identified by file names, so if these are not unique (or the archive
+    # is thin, which is cheap to recreate), it is created from scratch.
+    def _update_archive(self, response_file: str):
+        archive = self.executable_path()
+        objects = self._object_file_paths()
+        thin = self._is_thin_archive()
+        recorded_objects = build_state.recorded_inputs(archive) or {}
+        can_update = not thin and \
+            os.path.exists(archive) and not is_thin_archive(archive) and \
+            build_state.outputs_didnt_change(archive) and \
+            len({os.path.basename(path) for path in [*objects, *recorded_objects]}) == len(set([*objects, *recorded_objects]))
+
+        if not can_update:
+            if os.path.exists(archive):
+                os.remove(archive)
+            run_command(self._link_arguments(), response_file=response_file)
+            return
+
+        removed_objects = [path for path in recorded_objects if path not in objects]
+        changed_objects = [path for path in objects if recorded_objects.get(path) != file_state.hash(path)]
+        if removed_objects:
+            run_command(["ar", "-ds", archive, *[os.path.basename(path) for path in removed_objects]],
+                        response_file=response_file)
+        if changed_objects:
+            run_command(["ar", "-rcs", archive, *changed_objects], response_file=response_file)
+
+    def _link(self):
+        if self._link_output_didnt_change():
+            print(f"... {self._name} is up to date, not linking")
+            return
+
+        # Object lists of big targets may exceed the command line length
+        # limit, in which case they are passed in this file.
+        response_file = self._project.tmp_file(f"link/{self._name}.rsp")
+        if self.target_type == CppTargetType.STATIC_LIBRARY:
+            self._update_archive(response_file)
+        else:
+            run_command(self._link_arguments(), response_file=response_file)
+
+        build_state.record(self.executable_path(),
+                           inputs=self._link_inputs(),
+                           outputs=[self.executable_path()],
+                           command=shlex.join(self._link_arguments()))
+
+    def _is_thin_archive(self):
+        if self.thin_archive is not None:
+            return self.thin_archive
+        return self._project.thin_archives
+
     def _get_link_task(self):
         if self.link_task:
             return self.link_task
 
-        def link():
-            nonlocal self
-            # FIXME: This is not abstract enough.
-            linked_sources = ' '.join(
-                [src.object_file_path() for src in self.sources if isinstance(src, CppCompiledSource)])
-            linked_targets = ' '.join([lib.get_link_option()
-                                    for lib in self._linked_targets if isinstance(lib, CppTarget)])
-
-            match self.target_type:
-                case CppTargetType.EXECUTABLE:
-                    sprun(f"""g++
-                        -o {self.executable_path()}
-                        {linked_sources}
-                        {linked_targets}
-                        {self.link_config.build_command_line()}
-                    """)
-                case CppTargetType.STATIC_LIBRARY:
-                    sprun(f"""ar -rcs
-                        {self.executable_path()}
-                        {linked_sources}
-                        {linked_targets}
-                    """)
-                    
-
         dependency_tasks = [dep._get_link_task() for dep in self._linked_targets if isinstance(dep, CppTarget) and not dep.is_linking_up_to_date()]
-        self.link_task = Task(f"link {self._name}", link, cast(list[Task], [*self._get_source_tasks(), *dependency_tasks]))
+        self.link_task = Task(f"link {self._name}{self._project.variant_suffix()}", self._link, cast(list[Task], [*self._get_source_tasks(), *dependency_tasks]), kind="link", pool=self.link_pool, reason=self.is_linking_up_to_date().reason)
         return self.link_task
 
     def __init__(self, project: 'Project', target_type: CppTargetType, name: str, *, sources: list[Union[str, Source]]):
         super().__init__(project, name)
         self._linking_up_to_date = None
+        self._position_independent: bool | None = None
         self.target_type = target_type
         self.compile_config = BuildConfig(project.compile_config)
         self.link_config = BuildConfig(project.link_config)
         self.sources = self._resolve_sources_argument(sources)
+        self.precompiled_header: PrecompiledHeader | None = None
+        self.unity_batch_size: int | None = None
+        # Linker used instead of the project's one (passed to -fuse-ld).
+        self.linker: str | None = None
+        # Whether a static library is created as a thin archive, which
+        # references objects instead of copying them. Defaults to the
+        # project's setting.
+        self.thin_archive: bool | None = None
+        # Resource pool of the link task, if it is not the "link" pool.
+        self.link_pool: str | None = None
+        # Whether sources of the target can use C++20 modules. Defaults to
+        # the project's setting.
+        self.modules: bool | None = None
+        self.build_units: list[Source] | None = None
+        self._sources_up_to_date = dict[Source, UpToDate]()
         self.source_tasks = None
+        self.pch_task = None
         self.link_task = None
 
     def __repr__(self):
         return f"{self.target_type.name} {self._name}"
 
+    # Precompiles the given header with this target's compile_config and
+    # force-includes it in all sources of the target.
+    def set_precompiled_header(self, path: str):
+        self.precompiled_header = PrecompiledHeader(path, self)
+
+    # Compiles sources of the target in batches of `batch_size` sources
+    # (except the ones in `exclude`) when unity builds are not disabled.
+    def set_unity_build(self, batch_size: int | None = None, *, exclude: list[str] = []):
+        self.unity_batch_size = batch_size or config.unity_batch_size
+        for src in self.sources:
+            if isinstance(src, CppCompiledSource) and src.path() in exclude:
+                src.unity_build = False
+
+    # Links the target with the given linker, e.g "lld", "mold" or "gold".
+    def set_linker(self, linker: str):
+        self.linker = linker
+
+    # Links the target in a custom resource pool, e.g so that heavy LTO
+    # links can be limited separately (see Project.set_pool_limit).
+    def set_link_pool(self, pool: str):
+        self.link_pool = pool
+
+    # Enables C++20 modules for sources of the target (see
+    # Project.set_modules).
+    def set_modules(self, modules: bool = True):
+        self.modules = modules
+
+    def uses_modules(self) -> bool:
+        if self.modules is not None:
+            return self.modules
+        return self._project.modules
+
+    # Options that sources of the target need to be compiled with.
+    # Options of the project's variant are added here as well, so that they
+    # come after all other options.
+    def implicit_compile_options(self) -> list[str]:
+        options = self._project.variant_compile_options()
+        if self.uses_modules():
+            options = ["-fmodules-ts", f"-fmodule-mapper={self._project.module_mapper_path()}", *options]
+        if self._is_position_independent():
+            return ["-fPIC", *options]
+        return options
+
+    # Shared libraries, and static libraries that are linked into them
+    # (directly or through other static libraries), must be compiled as
+    # position independent code.
+    def _is_position_independent(self) -> bool:
+        if self.target_type == CppTargetType.SHARED_LIBRARY:
+            return True
+        if self.target_type != CppTargetType.STATIC_LIBRARY:
+            return False
+        # Note: This is memoized, because it is needed for every source.
+        if self._position_independent is None:
+            self._position_independent = any(
+                self in target._linked_libraries()
+                for target in self._project._targets.values()
+                if isinstance(target, CppTarget) and target.target_type == CppTargetType.SHARED_LIBRARY)
+        return self._position_independent
+
+    # Link options, including the ones of the project's variant.
+    def link_arguments(self) -> list[str]:
+        return [*self.link_config.build_arguments(), *self._project.variant_link_options()]
+
     def executable_path(self) -> str:
         match self.target_type:
             case CppTargetType.EXECUTABLE:
-                return config.build_file(self._name)
+                return self._project.build_file(self._name)
             case CppTargetType.STATIC_LIBRARY:
-                return f"{config.build_file(self._name)}.a"
+                return f"{self._project.build_file(self._name)}.a"
+            case CppTargetType.SHARED_LIBRARY:
+                return self._project.build_file(f"lib{self._name}.so")
 
-    def get_link_option(self):
+    def get_link_option(self) -> tuple[str, ...]:
         match self.target_type:
             case CppTargetType.EXECUTABLE:
                 raise Exception(
                     f"Cannot link to executable '{self.name()}'. Ensure that '{self.name()}' is a library")
             case CppTargetType.STATIC_LIBRARY:
-                return f"{self.executable_path()}"
-
-    def is_linking_up_to_date(self):
-        if self._linking_up_to_date:
+                return (self.executable_path(),)
+            case CppTargetType.SHARED_LIBRARY:
+                # rpath makes the library found when running from the build
+                # directory.
+                return (self.executable_path(), f"-Wl,-rpath,{os.path.dirname(self.executable_path())}")
+
+    def is_linking_up_to_date(self) -> UpToDate:
+        # Note: This is memoized, because it is checked recursively for every
+        #       target linking this one.
+        if self._linking_up_to_date is not None:
             return self._linking_up_to_date
+        self._linking_up_to_date = self._check_linking_up_to_date()
+        return self._linking_up_to_date
 
+    def _check_linking_up_to_date(self) -> UpToDate:
         # linking is up to date if:
         # 1. The executable actually exists
-        # 2. All sources are up-to-date
+        # 2. No source is rebuilt, which is also the case if the PCH is
+        #    rebuilt or a module imported by the source is.
         # 3. All dependencies (that are static libraries) have linking up-to-date.
-        return \
-            os.path.exists(self.executable_path()) and \
-            all([src.is_up_to_date() for src in self.sources]) and \
-            all([lib.is_linking_up_to_date() for lib in self._linked_targets]) 
+        # 4. It was linked from the current objects and libraries, with the
+        #    current flags.
+        if not os.path.exists(self.executable_path()):
+            return out_of_date(f"{display_path(self.executable_path())} is missing")
+        for src in self._get_build_units():
+            if not self._source_is_up_to_date(src):
+                return out_of_date(f"source {src.name()} is rebuilt")
+        for lib in self._linked_targets:
+            if not lib.is_linking_up_to_date():
+                return out_of_date(f"{lib.name()} is rebuilt")
+        return self._link_output_didnt_change()
+
+    def input_files(self):
+        sources = [*self.sources, *self._get_build_units()]
+        if self.precompiled_header:
+            sources.append(self.precompiled_header)
+        return [path for src in sources for path in src.input_files()]
+
+    def reset(self):
+        self._linking_up_to_date = None
+        self._position_independent = None
+        self.build_units = None
+        self._sources_up_to_date.clear()
+        for src in self.sources:
+            src.reset()
+        self.source_tasks = None
+        self.pch_task = None
+        self.link_task = None
 
     def get_tasks(self):
         # Note: It is important to store task objects, because they are compared
         #       to in dependency checks.
-        return [*self._get_source_tasks()] + ([] if self.is_linking_up_to_date() else [self._get_link_task()])
+        pch_task = self._get_pch_task()
+        return ([pch_task] if pch_task else []) + [*self._get_source_tasks()] + ([] if self.is_linking_up_to_date() else [self._get_link_task()])
 
     def run(self):
         if self.target_type != CppTargetType.EXECUTABLE:
             raise Exception(f"Cannot run non-executable target {self.name()}")
-        sp.run(self.executable_path())
+        return sp.run(self.executable_path()).returncode
 
 class GeneratedTarget(Target):
-    def __init__(self, project: 'Project', name: str, sources: list[str], generator: Callable[[list[str]], None]):
+    # `outputs` are paths (relative to the build directory) of files written
+    # by the generator. If they are given, the generator is run only if its
+    # sources, outputs or code changed since it was last run. Only the code
+    # of the generator function itself is tracked, not of functions or
+    # globals that it uses.
+    def __init__(self, project: 'Project', name: str, sources: list[str], generator: Callable[[list[str]], None], outputs: list[str] = []):
         super().__init__(project, name)
         self._sources = sources
         self._generator = generator
+        self._outputs = outputs
+        self._generate_task = None
+
+    def output_paths(self):
+        return [config.build_file(path) for path in self._outputs]
+
+    def _state_key(self):
+        return f"generated:{self._name}"
+
+    # Command recorded in the build state, so that the generator is run
+    # again if its code or the lists of its sources or outputs change.
+    def _command(self) -> str | None:
+        generator_hash = function_code_hash(self._generator)
+        if generator_hash is None:
+            return None
+        return f"{generator_hash} sources={shlex.join(self._sources)} outputs={shlex.join(self._outputs)}"
+
+    def is_up_to_date(self) -> UpToDate:
+        # Generated target is up to date if:
+        # 1. It declares its outputs, and they all exist
+        # 2. Its sources and the generator code didn't change since it was run
+        # 3. Its outputs weren't modified since then
+        if not self._outputs:
+            return out_of_date("generator doesn't declare its outputs")
+        command = self._command()
+        if command is None:
+            return out_of_date("generator code can't be hashed")
+        for path in self.output_paths():
+            if not os.path.exists(path):
+                return out_of_date(f"output {display_path(path)} is missing")
+        return build_state.inputs_didnt_change(self._state_key(), command, "generator code, sources or outputs") and \
+            build_state.outputs_didnt_change(self._state_key())
+
+    # Runs the generator. Outputs that end up with the same content get their
+    # old mtime back, so that nothing that depends on them is invalidated.
+    def run_generator(self):
+        old_outputs = dict[str, tuple[str, os.stat_result]]()
+        for path in self.output_paths():
+            if os.path.exists(path):
+                old_outputs[path] = (calculate_file_hash(path), os.stat(path))
+
+        self._generator(self._sources)
+
+        for path, (old_hash, old_stat) in old_outputs.items():
+            if os.path.exists(path) and calculate_file_hash(path) == old_hash:
+                os.utime(path, ns=(old_stat.st_atime_ns, old_stat.st_mtime_ns))
+
+    def generate(self):
+        if generator_pool.enabled():
+            generator_pool.run(self._name)
+        else:
+            self.run_generator()
+
+        if not self._outputs:
+            # We don't know which files the generator wrote.
+            file_state.invalidate()
+            return
+
+        for path in self.output_paths():
+            file_state.invalidate(path)
+        build_state.record(self._state_key(),
+                           inputs=self.input_files(),
+                           outputs=self.output_paths(),
+                           command=self._command())
+
+    def _get_generate_task(self):
+        if self._generate_task:
+            return self._generate_task
+        result = self.is_up_to_date()
+        if not result:
+            self._generate_task = Task(f"generate: {self._sources}", self.generate, [], kind="generate", reason=result.reason)
+        return self._generate_task
 
-        def generate():
-            nonlocal self, generator
-            # TODO: Up to date check
-            generator(self._sources)
+    def get_tasks(self):
+        task = self._get_generate_task()
+        return [task] if task else []
 
-        self._generate_task = Task(f"generate: {sources}", generate, [])
+    def input_files(self):
+        return [config.source_file(path) for path in self._sources]
 
-    def get_tasks(self):
-        return [self._generate_task]
+    def reset(self):
+        self._generate_task = None
 
     def is_linking_up_to_date(self):
-        # TODO
-        return True
+        # Targets using generated files need to be rebuilt if the generator
+        # runs.
+        return self.is_up_to_date()
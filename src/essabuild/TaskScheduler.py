@@ -1,15 +1,38 @@
-from typing import Callable
+from typing import Any, Callable
 
+import heapq
 import logging
 
 
 class Task:
 
-    def __init__(self, name: str, worker: Callable[[], None],
-                 dependencies: list['Task']):
+    # `kind` is what the task does, e.g "compile", "link" or "generate".
+    # `cost` is a rough estimate of how long the task takes relatively to
+    # other tasks. It is used to prioritize tasks on the critical path.
+    # `remote_worker` performs the task using a remote compile client (see
+    # RemoteExecutor), if the task can be performed remotely.
+    # `pool` is the resource pool the task belongs to (see TaskScheduler),
+    # which is its kind by default.
+    # `reason` says why the task is performed, i.e why what it builds is
+    # not up to date.
+    def __init__(self,
+                 name: str,
+                 worker: Callable[[], None],
+                 dependencies: list['Task'],
+                 *,
+                 kind: str = "other",
+                 cost: int = 1,
+                 remote_worker: Callable[[Any], None] | None = None,
+                 pool: str | None = None,
+                 reason: str | None = None):
         self.name = name
         self.worker = worker
         self.dependencies = dependencies
+        self.kind = kind
+        self.cost = cost
+        self.remote_worker = remote_worker
+        self.pool = pool or kind
+        self.reason = reason
 
     def __str__(self):
         return f"Task({self.name})"
@@ -19,56 +42,165 @@ class Task:
 
 
 class TaskScheduler:
+    # Tasks are handed out in order of priority, but at most
+    # `pool_limits[pool]` tasks of a pool are performed at once (similarly
+    # to ninja pools). Pools without a limit are unlimited.
+
+    def __init__(self, pool_limits: dict[str, int] = {}):
+        self._tasks = list[Task]()
+        self._scheduled_tasks = set[Task]()
+        self._prepared = False
+
+        # Number of dependencies of each task that are not done yet.
+        self._pending_dependencies = dict[Task, int]()
+        # Reverse dependency edges.
+        self._dependents = dict[Task, list[Task]]()
+        # Length of the longest path from a task to the end of the build,
+        # including the task itself.
+        self._priorities = dict[Task, int]()
+        # Heaps of (-priority, insertion order, task) of tasks that have all
+        # dependencies done, per pool.
+        self._ready = dict[str, list[tuple[int, int, Task]]]()
+        self._order = dict[Task, int]()
+        for pool, limit in pool_limits.items():
+            if limit < 1:
+                raise Exception(f"Limit of pool {pool} must be positive")
+        self._pool_limits = pool_limits
+        # Number of currently performed tasks of each pool.
+        self._pool_usage = dict[str, int]()
 
-    class TaskState:
-        task: Task
-
-        def __init__(self, task: Task):
-            self.task = task
-
-    def __init__(self):
-        self.remaining_tasks = list[Task]()
         self.currently_performed_tasks = set[Task]()
         self.done_tasks = set[Task]()
+        self.failed_tasks = set[Task]()
+        # Tasks that won't be performed, because some of their (transitive)
+        # dependencies failed.
+        self.cancelled_tasks = set[Task]()
 
     def add_task(self, task: Task):
-        self.remaining_tasks.append(task)
-
+        if self._prepared:
+            raise Exception(
+                f"Cannot add {task} after the scheduler was started")
+        if task in self._scheduled_tasks:
+            return
+        self._order[task] = len(self._tasks)
+        self._tasks.append(task)
+        self._scheduled_tasks.add(task)
+
+    def _prepare(self):
+        self._prepared = True
+        for task in self._tasks:
+            self._pending_dependencies[task] = 0
+            self._dependents[task] = []
+
+        for task in self._tasks:
+            for dep in set(task.dependencies):
+                if dep not in self._scheduled_tasks:
+                    logging.warning(
+                        "Dependency %s of %s is unfinished but is also not scheduled, skipping! This is a bug.",
+                        dep, task)
+                    continue
+                self._pending_dependencies[task] += 1
+                self._dependents[dep].append(task)
+
+        # Topological sort (Kahn's algorithm). It is done up front so that
+        # circular dependencies are reported before anything is built.
+        pending = dict(self._pending_dependencies)
+        topological_order = [
+            task for task in self._tasks if pending[task] == 0
+        ]
+        for task in topological_order:
+            for dependent in self._dependents[task]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    topological_order.append(dependent)
+
+        if len(topological_order) != len(self._tasks):
+            cyclic_tasks = [task for task in self._tasks if pending[task] > 0]
+            for task in cyclic_tasks:
+                print(repr(task))
+            raise Exception(
+                f"Circular dependencies found between {len(cyclic_tasks)} tasks"
+            )
+
+        for task in reversed(topological_order):
+            self._priorities[task] = task.cost + max(
+                (self._priorities[dependent]
+                 for dependent in self._dependents[task]),
+                default=0)
+
+        for task in self._tasks:
+            if self._pending_dependencies[task] == 0:
+                self._push_ready(task)
+
+    def _push_ready(self, task: Task):
+        heapq.heappush(self._ready.setdefault(task.pool, []),
+                       (-self._priorities[task], self._order[task], task))
+
+    def _pool_is_full(self, pool: str):
+        limit = self._pool_limits.get(pool)
+        return limit is not None and self._pool_usage.get(pool, 0) >= limit
+
+    # Returns a task which has all dependencies done and whose pool is not
+    # full, or None if there is no such task at the moment.
     def get_next_task(self):
-        for task in self.remaining_tasks:
-            all_dependencies_are_worked_on = True
-            for dep in task.dependencies:
-                if not dep in self.currently_performed_tasks and not dep in self.done_tasks:
-                    if not dep in self.remaining_tasks:
-                        logging.warning("Dependency %s of %s is unfinished but is also not scheduled, skipping! This is a bug.", dep, task)
-                        continue
-                    logging.debug(
-                        "Skipping %s because of unfinished dependency %s.",
-                        task, dep)
-                    all_dependencies_are_worked_on = False
-                    break
-            if all_dependencies_are_worked_on:
-                self.currently_performed_tasks.add(task)
-                self.remaining_tasks.remove(task)
-                return task
-
-        if len(self.remaining_tasks) > 0:
-            logging.warning(
-                f"No suitable task found but {len(self.remaining_tasks)} left to do!\
-                    This is probably because of circular dependencies.")
-            for task in self.remaining_tasks:
-                print(task)
-
-        return None
+        if not self._prepared:
+            self._prepare()
+        # There are only a few pools, so they are simply all checked.
+        best_heap = None
+        for pool, heap in self._ready.items():
+            if not heap or self._pool_is_full(pool):
+                continue
+            if not best_heap or heap[0] < best_heap[0]:
+                best_heap = heap
+        if not best_heap:
+            return None
+        _, _, task = heapq.heappop(best_heap)
+        self._pool_usage[task.pool] = self._pool_usage.get(task.pool, 0) + 1
+        self.currently_performed_tasks.add(task)
+        return task
 
     def mark_as_done(self, task: Task):
         self.done_tasks.add(task)
         assert (task in self.currently_performed_tasks)
         self.currently_performed_tasks.remove(task)
+        self._pool_usage[task.pool] -= 1
+        for dependent in self._dependents[task]:
+            self._pending_dependencies[dependent] -= 1
+            if self._pending_dependencies[dependent] == 0:
+                self._push_ready(dependent)
+
+    # Marks the task as failed, and cancels all tasks that depend on it.
+    # Returns the newly cancelled tasks.
+    def mark_as_failed(self, task: Task) -> list[Task]:
+        self.failed_tasks.add(task)
+        assert (task in self.currently_performed_tasks)
+        self.currently_performed_tasks.remove(task)
+        self._pool_usage[task.pool] -= 1
+
+        # Dependents of a failed task never become ready, because the
+        # failed task is never marked as done, so they are only recorded.
+        cancelled = list[Task]()
+        stack = list(self._dependents[task])
+        while stack:
+            dependent = stack.pop()
+            if dependent in self.cancelled_tasks:
+                continue
+            self.cancelled_tasks.add(dependent)
+            cancelled.append(dependent)
+            stack += self._dependents[dependent]
+        return cancelled
+
+    def remaining_tasks(self):
+        return [
+            task for task in self._tasks if task not in self.done_tasks
+            and task not in self.currently_performed_tasks
+            and task not in self.failed_tasks
+            and task not in self.cancelled_tasks
+        ]
 
     def dump(self):
         print("Remaining tasks:")
-        for task in self.remaining_tasks:
+        for task in self.remaining_tasks():
             print(repr(task))
         print("Currently performed tasks:")
         for task in self.currently_performed_tasks:
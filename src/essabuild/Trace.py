@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+
+from .TaskScheduler import Task
+from .Utils import CommandStats
+
+
+class TaskTrace:
+    # Timing of a single performed task.
+
+    def __init__(self, task: Task, lane: int, start: float, end: float,
+                 commands: list[CommandStats]):
+        self.task = task
+        self.lane = lane
+        self.start = start
+        self.end = end
+        self.commands = commands
+
+    def duration(self):
+        return self.end - self.start
+
+
+class BuildTrace:
+    # Collects timings of all tasks performed in a build, and writes them
+    # as a Chrome trace event file (viewable in chrome://tracing or
+    # Perfetto), with one lane per worker thread.
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._lanes = dict[int, int]()
+        self.tasks = list[TaskTrace]()
+
+    def now(self):
+        return time.perf_counter() - self._start
+
+    # Returns index of the worker lane for the current thread.
+    def current_lane(self) -> int:
+        with self._lock:
+            return self._lanes.setdefault(threading.get_ident(),
+                                          len(self._lanes))
+
+    def add(self, task_trace: TaskTrace):
+        with self._lock:
+            self.tasks.append(task_trace)
+
+    def write(self, path: str):
+        events = list[dict]()
+        for lane in range(len(self._lanes)):
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": lane,
+                "args": {
+                    "name": f"worker {lane}"
+                },
+            })
+        for task_trace in self.tasks:
+            events.append({
+                "name": task_trace.task.name,
+                "cat": task_trace.task.kind,
+                "ph": "X",
+                "pid": 1,
+                "tid": task_trace.lane,
+                "ts": int(task_trace.start * 1_000_000),
+                "dur": int(task_trace.duration() * 1_000_000),
+                "args": {
+                    "commands": [{
+                        "command": command.command,
+                        "wall_time": command.wall_time,
+                        "cpu_time": command.cpu_time,
+                        "max_rss_kb": command.max_rss_kb,
+                    } for command in task_trace.commands]
+                },
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f)
+
+    # Returns the chain of performed tasks with the longest total duration,
+    # following dependencies.
+    def critical_path(self) -> list[TaskTrace]:
+        traces = {
+            task_trace.task: task_trace
+            for task_trace in sorted(self.tasks, key=lambda t: t.end)
+        }
+        path_lengths = dict[Task, float]()
+        predecessors = dict[Task, Task | None]()
+        for task, task_trace in traces.items():
+            predecessor = max(
+                (dep for dep in task.dependencies if dep in path_lengths),
+                key=lambda dep: path_lengths[dep],
+                default=None)
+            predecessors[task] = predecessor
+            path_lengths[task] = task_trace.duration() + (
+                path_lengths[predecessor] if predecessor else 0)
+
+        if not path_lengths:
+            return []
+        task: Task | None = max(path_lengths, key=lambda t: path_lengths[t])
+        path = list[TaskTrace]()
+        while task:
+            path.append(traces[task])
+            task = predecessors[task]
+        return list(reversed(path))
+
+    def print_summary(self, count: int = 10):
+
+        def print_task(task_trace: TaskTrace):
+            cpu_time = sum(c.cpu_time for c in task_trace.commands)
+            max_rss = max((c.max_rss_kb for c in task_trace.commands),
+                          default=0)
+            print(f"  {task_trace.duration():8.3f}s  cpu {cpu_time:8.3f}s  "
+                  f"rss {max_rss // 1024:6} MiB  {task_trace.task.name}")
+
+        def print_slowest(kind: str, title: str):
+            task_traces = [t for t in self.tasks if t.task.kind == kind]
+            if not task_traces:
+                return
+            print(f"\033[34;1m{title}:\033[m")
+            for task_trace in sorted(task_traces,
+                                     key=lambda t: t.duration(),
+                                     reverse=True)[:count]:
+                print_task(task_trace)
+
+        print_slowest("compile", "Slowest translation units")
+        print_slowest("link", "Slowest links")
+
+        critical_path = self.critical_path()
+        if critical_path:
+            print(f"\033[34;1mCritical path\033[m "
+                  f"({sum(t.duration() for t in critical_path):.3f}s):")
+            for task_trace in critical_path:
+                print_task(task_trace)
@@ -0,0 +1,30 @@
+class UpToDate:
+    # Result of checking whether something is up to date. It is truthy if
+    # it is up to date, and otherwise `reason` says why it isn't, e.g
+    # "object file is missing". Checks can be chained with `and`, which
+    # results in the first failed check.
+
+    def __init__(self, reason: str | None = None):
+        self.reason = reason
+
+    def __bool__(self):
+        return self.reason is None
+
+    def __str__(self):
+        return self.reason or "up to date"
+
+    def __repr__(self):
+        return f"UpToDate({self.reason!r})"
+
+
+up_to_date = UpToDate()
+
+
+def out_of_date(reason: str) -> UpToDate:
+    return UpToDate(reason)
+
+
+# Returns up_to_date if `condition` holds, and out_of_date(reason)
+# otherwise.
+def check(condition: bool, reason: str) -> UpToDate:
+    return up_to_date if condition else out_of_date(reason)
@@ -1,8 +1,179 @@
+import contextlib
+import hashlib
+import io
+import marshal
+import os
+import shlex
 import subprocess as sp
 import logging
+import sys
+import threading
+import time
 
-def sprun(cmd):
-    logging.debug(f"subprocess.run: {cmd}")
-    result = sp.run(cmd.replace("\n", " "), shell=True)
+_task_output = threading.local()
+
+
+class _TaskOutputStream(io.TextIOBase):
+    # Redirects writes to the output buffer of the task performed by the
+    # current thread, so that output of tasks running in parallel is not
+    # interleaved.
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, s):
+        buffer = getattr(_task_output, "buffer", None)
+        if buffer is None:
+            return self._stream.write(s)
+        return buffer.write(s)
+
+    def flush(self):
+        self._stream.flush()
+
+
+@contextlib.contextmanager
+def task_output_redirected():
+    old_stdout = sys.stdout
+    sys.stdout = _TaskOutputStream(old_stdout)
+    try:
+        yield
+    finally:
+        sys.stdout = old_stdout
+
+
+@contextlib.contextmanager
+def buffered_task_output():
+    buffer = io.StringIO()
+    _task_output.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _task_output.buffer = None
+
+
+class CommandStats:
+    # Resources used by a command run by a task.
+
+    def __init__(self, command: str, wall_time: float, cpu_time: float,
+                 max_rss_kb: int, returncode: int):
+        self.command = command
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_rss_kb = max_rss_kb
+        self.returncode = returncode
+
+
+@contextlib.contextmanager
+def recorded_task_commands():
+    commands = list[CommandStats]()
+    _task_output.commands = commands
+    try:
+        yield commands
+    finally:
+        _task_output.commands = None
+
+
+# Adds the command to the ones run by the current task.
+def record_command_stats(stats: CommandStats):
+    commands = getattr(_task_output, "commands", None)
+    if commands is not None:
+        commands.append(stats)
+
+
+class CommandResult:
+    # Outcome of a command run by `run_command`. `output` contains both
+    # stdout and stderr, in the order they were written.
+
+    def __init__(self, arguments: list[str], returncode: int, output: str):
+        self.arguments = arguments
+        self.returncode = returncode
+        self.output = output
+
+    def command(self):
+        return shlex.join(self.arguments)
+
+
+class CommandError(Exception):
+
+    def __init__(self, result: CommandResult):
+        super().__init__(
+            f"command failed with exit code {result.returncode}: {result.command()}"
+        )
+        self.result = result
+
+
+# Command lines longer than this are passed through a response file, which
+# keeps them well below the limits of a single argument and the whole
+# argv (and is understood by both gcc and ar).
+RESPONSE_FILE_THRESHOLD = 64 * 1024
+
+
+# Runs a command directly (without a shell) and writes its output to the
+# output of the current task. If `response_file` is given and the command
+# line is long, arguments are passed through that file.
+def run_command(arguments: list[str],
+                *,
+                response_file: str | None = None) -> CommandResult:
+    command = shlex.join(arguments)
+    logging.debug(f"run_command: {command}")
+
+    exec_arguments = arguments
+    if response_file and sum(len(arg) + 1 for arg in arguments) > RESPONSE_FILE_THRESHOLD:
+        os.makedirs(os.path.dirname(response_file), exist_ok=True)
+        with open(response_file, "w") as f:
+            f.write("\n".join(shlex.quote(arg) for arg in arguments[1:]))
+        exec_arguments = [arguments[0], f"@{response_file}"]
+
+    start = time.perf_counter()
+    process = sp.Popen(exec_arguments,
+                       stdin=sp.DEVNULL,
+                       stdout=sp.PIPE,
+                       stderr=sp.STDOUT)
+    assert process.stdout
+    # Output may quote non-UTF-8 bytes of sources, e.g in warnings.
+    output = process.stdout.read().decode(errors="replace")
+    process.stdout.close()
+    # wait4() is used instead of wait() to get resource usage of the
+    # command (which includes processes it waited for, e.g cc1plus).
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    record_command_stats(
+        CommandStats(command, time.perf_counter() - start,
+                     rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss,
+                     process.returncode))
+
+    result = CommandResult(arguments, process.returncode, output)
+    sys.stdout.write(output)
     if result.returncode != 0:
-        raise Exception(f"command failed: {cmd}")
+        raise CommandError(result)
+    return result
+
+
+# Writes `content` to the file unless it already has exactly this content,
+# so that its mtime is preserved and consumers are not invalidated.
+def write_file_if_changed(path: str, content: str):
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+# Returns a hash of the function's bytecode and constants, or None if it
+# has none (e.g it is a builtin). Functions and globals that it calls are not
+# included.
+def function_code_hash(function) -> str | None:
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return None
+    return hashlib.md5(marshal.dumps(code)).hexdigest()
+
+
+def is_thin_archive(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(8) == b"!<thin>\n"
@@ -0,0 +1,18 @@
+from .BuildConfig import BuildConfig
+
+
+class Variant:
+    # Named configuration of a project, e.g "debug" or "asan". Every variant
+    # is built from a copy of the project, into its own subdirectory of the
+    # build directory. Options of the variant are added after all other
+    # options, so they take precedence.
+
+    def __init__(self, name: str):
+        if not name or "/" in name or name.startswith("."):
+            raise Exception(f"Invalid variant name: '{name}'")
+        self.name = name
+        self.compile_config = BuildConfig(None, defaults=False)
+        self.link_config = BuildConfig(None, defaults=False)
+
+    def __repr__(self):
+        return f"Variant({self.name})"
@@ -0,0 +1,120 @@
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+
+class Watcher(abc.ABC):
+    # Waits for changes of a set of files.
+
+    # Blocks until at least one of `paths` is changed, created or removed,
+    # and returns all paths from `paths` that changed.
+    @abc.abstractmethod
+    def wait(self, paths: set[str]) -> set[str]:
+        return
+
+
+class InotifyWatcher(Watcher):
+    # Linux-only watcher that watches directories containing the files.
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_CLOEXEC = 0o2000000
+
+    EVENT_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    # Changes are collected until no new event arrives for this long, so
+    # that e.g saving many files at once results in a single rebuild.
+    DEBOUNCE_SECONDS = 0.1
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = dict[int, str]()
+        self._watched_directories = set[str]()
+
+    def _watch_directory(self, directory: str):
+        if directory in self._watched_directories:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, directory.encode(),
+                                          self.EVENT_MASK)
+        if wd < 0:
+            return
+        self._directories[wd] = directory
+        self._watched_directories.add(directory)
+
+    def _read_events(self, timeout: float | None) -> set[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set[str]()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode()
+            offset += length
+            directory = self._directories.get(wd)
+            if directory and name:
+                changed.add(os.path.join(directory, name))
+        return changed
+
+    def wait(self, paths: set[str]) -> set[str]:
+        for path in paths:
+            self._watch_directory(os.path.dirname(path))
+
+        while True:
+            changed = self._read_events(None)
+            while True:
+                more_changes = self._read_events(self.DEBOUNCE_SECONDS)
+                if not more_changes:
+                    break
+                changed |= more_changes
+            changed &= paths
+            if changed:
+                return changed
+
+
+class PollingWatcher(Watcher):
+    # Fallback watcher that periodically compares stat signatures of files.
+
+    INTERVAL_SECONDS = 0.5
+
+    def _signature(self, path: str):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def wait(self, paths: set[str]) -> set[str]:
+        signatures = {path: self._signature(path) for path in paths}
+        while True:
+            time.sleep(self.INTERVAL_SECONDS)
+            changed = {
+                path
+                for path in paths
+                if self._signature(path) != signatures[path]
+            }
+            if changed:
+                return changed
+
+
+def create_watcher() -> Watcher:
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
@@ -1,3 +1,4 @@
+import argparse
 import traceback
 import os
 import sys
@@ -5,32 +6,203 @@ import logging
 
 import essabuild as eb
 import essabuild.BuildSystem
+import essabuild.Remote
 
 
 def main():
     # logging.basicConfig(level=logging.DEBUG)
 
-    # TODO: Use argparse
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} build | [run <target>]")
-        return 1
+    build_options = argparse.ArgumentParser(add_help=False)
+    build_options.add_argument("-j",
+                               "--jobs",
+                               type=int,
+                               default=eb.config.jobs,
+                               help="number of tasks performed in parallel "
+                               "(default: number of CPUs)")
+    build_options.add_argument(
+        "--variant",
+        action="append",
+        metavar="NAME",
+        help="build only the given variant (can be given multiple times, "
+        "default: all variants); `run` runs the first one")
+    build_options.add_argument(
+        "-k",
+        "--keep-going",
+        action="store_true",
+        help="keep building everything that doesn't depend on a failed "
+        "task, instead of stopping at the first failure")
+    build_options.add_argument(
+        "--explain",
+        action="store_true",
+        help="print why every performed task is needed, e.g which input "
+        "changed")
+    build_options.add_argument(
+        "--pool",
+        action="append",
+        default=[],
+        metavar="POOL=N",
+        help="perform at most N tasks of the given pool (e.g compile, link, "
+        "generate) at once")
+    build_options.add_argument(
+        "-l",
+        "--max-load",
+        type=float,
+        metavar="N",
+        help="don't start new tasks while the load average is above N")
+    build_options.add_argument(
+        "--min-free-memory",
+        type=int,
+        metavar="MIB",
+        help="don't start new tasks while less than MIB MiB of memory is "
+        "available")
+    unity_options = build_options.add_mutually_exclusive_group()
+    unity_options.add_argument(
+        "--unity",
+        nargs="?",
+        type=int,
+        const=eb.config.unity_batch_size,
+        metavar="BATCH_SIZE",
+        help="compile sources of all targets in unity batches")
+    unity_options.add_argument(
+        "--no-unity",
+        action="store_true",
+        help="compile every source separately, even if unity build mode "
+        "is enabled in build.py")
+    build_options.add_argument(
+        "--generator-processes",
+        type=int,
+        default=0,
+        metavar="N",
+        help="run generators in a pool of N processes")
+    build_options.add_argument(
+        "--remote-worker",
+        action="append",
+        default=[
+            worker
+            for worker in os.environ.get("ESSABUILD_REMOTE_WORKERS", "").split(",")
+            if worker
+        ],
+        metavar="HOST:PORT",
+        help="compile sources on the given remote worker (can be given "
+        "multiple times, default: $ESSABUILD_REMOTE_WORKERS)")
+    build_options.add_argument(
+        "--remote-window",
+        type=int,
+        default=eb.config.remote_window,
+        metavar="N",
+        help="maximum number of compile jobs sent to remote workers at once")
+    build_options.add_argument(
+        "--no-graph-cache",
+        action="store_true",
+        help="always execute build.py instead of using the build graph "
+        "cached by the previous run")
+    build_options.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write a Chrome trace of the build to FILE and print timing "
+        "summary")
+    build_options.add_argument(
+        "--cache-dir",
+        default=os.environ.get("ESSABUILD_CACHE_DIR"),
+        help="directory of the object cache shared between builds "
+        "(default: $ESSABUILD_CACHE_DIR, disabled if not set)")
+    build_options.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=eb.config.cache_max_size // (1024 * 1024),
+        help="maximum size of the object cache in MiB")
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", parents=[build_options])
+    build_parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only print tasks that would be performed, without performing "
+        "them")
+    build_parser.add_argument(
+        "targets",
+        nargs="*",
+        help="targets to build, with everything they need (default: all)")
+    watch_parser = subparsers.add_parser(
+        "watch",
+        parents=[build_options],
+        help="build the project every time its files change")
+    watch_parser.add_argument(
+        "targets",
+        nargs="*",
+        help="targets to build, with everything they need (default: all)")
+    run_parser = subparsers.add_parser("run", parents=[build_options])
+    run_parser.add_argument("target")
+    generate_parser = subparsers.add_parser(
+        "generate",
+        parents=[build_options],
+        help="generate build files for another build system")
+    generate_parser.add_argument("backend", choices=["ninja"])
+    run_generator_parser = subparsers.add_parser(
+        "run-generator",
+        parents=[build_options],
+        help="run generator of a generated target")
+    run_generator_parser.add_argument("target")
+    worker_parser = subparsers.add_parser(
+        "worker", help="run a worker compiling sources for remote builds")
+    worker_parser.add_argument("--listen",
+                               default="0.0.0.0:7878",
+                               metavar="HOST:PORT",
+                               help="address to listen on (default: %(default)s)")
+    worker_parser.add_argument("-j",
+                               "--jobs",
+                               type=int,
+                               default=eb.config.jobs,
+                               help="number of sources compiled in parallel "
+                               "(default: number of CPUs)")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        essabuild.Remote.run_worker(args.listen, args.jobs)
+        return 0
+
     cwd = os.getcwd()
-    command = sys.argv[1]
+    command = args.command
     eb.config.source_directory = cwd
     eb.config.build_directory = os.path.join(eb.config.source_directory,
                                              "build")
     eb.config.tmp_directory = os.path.join(eb.config.build_directory,
                                            ".eb_tmp")
+    eb.config.jobs = args.jobs
+    eb.config.generator_processes = args.generator_processes
+    eb.config.graph_cache = not args.no_graph_cache
+    eb.config.pool_limits = {}
+    for pool in args.pool:
+        name, _, limit = pool.partition("=")
+        if not limit.isdigit() or int(limit) < 1:
+            parser.error(f"invalid pool limit: {pool}")
+        eb.config.pool_limits[name] = int(limit)
+    eb.config.max_load = args.max_load
+    eb.config.keep_going = args.keep_going
+    eb.config.explain = args.explain
+    eb.config.dry_run = getattr(args, "dry_run", False)
+    eb.config.variants = args.variant
+    if args.min_free_memory is not None:
+        eb.config.min_free_memory = args.min_free_memory * 1024 * 1024
+    eb.config.remote_workers = args.remote_worker
+    eb.config.remote_window = args.remote_window
+    if args.unity:
+        eb.config.unity_build = True
+        eb.config.unity_batch_size = args.unity
+    elif args.no_unity:
+        eb.config.unity_build = False
+    if args.trace:
+        eb.config.trace_file = os.path.abspath(args.trace)
+    if args.cache_dir:
+        eb.config.cache_directory = os.path.abspath(args.cache_dir)
+    eb.config.cache_max_size = args.cache_max_size * 1024 * 1024
 
     do_build = command == "build" or command == "run"
     do_run = command == "run"
-    if do_run:
-        if len(sys.argv) != 3:
-            print(f"Expected target name")
-            return 1
-        run_target = sys.argv[2]
-    else:
-        run_target = None
+    do_watch = command == "watch"
+    run_target = args.target if do_run else None
 
     filename = f"{eb.config.source_directory}/build.py"
 
@@ -38,22 +210,26 @@ def main():
     print(f"Build dir:  {eb.config.build_directory}")
     print(f"Tmp dir:  {eb.config.tmp_directory}")
     try:
-        with open(filename) as f:
-            sys.path.append(os.path.dirname(__file__))
-            compiled = compile(f.read(), filename, "exec")
-            exec(compiled)
+        sys.path.append(os.path.dirname(__file__))
+        essabuild.BuildSystem.load_cached_project(filename)
     except FileNotFoundError:
         print(f"There is no EssaBuild project in {cwd}.")
+        return 1
     except SystemError as e:
         print(f"Failed to open build.py: {e}")
+        return 1
 
     try:
-        essabuild.BuildSystem.main(build=do_build,
+        return essabuild.BuildSystem.main(build=do_build,
                                    run=do_run,
-                                   run_target=run_target)
+                                   run_target=run_target,
+                                   build_targets=getattr(args, "targets", None) or None,
+                                   watch_file=filename if do_watch else None,
+                                   generate_ninja=sys.argv[1:] if command == "generate" else None,
+                                   generator_target=args.target if command == "run-generator" else None)
     except Exception as e:
         traceback.print_exc()
-    return 0
+        return 1
 
 
 if __name__ == "__main__":
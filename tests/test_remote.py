@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from essabuild.Remote import PROTOCOL_VERSION, WorkerServer, forbidden_remote_options
+
+
+class WorkerServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = WorkerServer(("localhost", 0), 1)
+
+    def tearDown(self):
+        self.server.server_close()
+
+    def compile(self, arguments: list[str], source: bytes):
+        return self.server.compile(
+            {
+                "version": PROTOCOL_VERSION,
+                "arguments": arguments
+            }, source)
+
+    def test_refuses_module_mapper(self):
+        with tempfile.TemporaryDirectory() as directory:
+            marker = os.path.join(directory, "pwned")
+            response, object_data = self.compile([
+                "-fmodules-ts", f"-fmodule-mapper=|/usr/bin/touch {marker}"
+            ], b"import foo;\n")
+            self.assertNotEqual(response["returncode"], 0)
+            self.assertIn("Forbidden options", response["output"])
+            self.assertEqual(object_data, b"")
+            self.assertFalse(os.path.exists(marker))
+
+    def test_refuses_options_reading_files(self):
+        for arguments in [["-x", "c++", "-include", "/etc/passwd"],
+                          ["-imacros", "/etc/passwd"], ["-I/etc"],
+                          ["/etc/passwd"], ["-Wp,-MD,/tmp/file"],
+                          ["-fprofile-use=/tmp/profile"]]:
+            with self.subTest(arguments=arguments):
+                response, _ = self.compile(arguments, b"int main() {}\n")
+                self.assertNotEqual(response["returncode"], 0)
+                self.assertIn("Forbidden options", response["output"])
+
+    def test_allows_code_generation_options(self):
+        self.assertEqual(
+            forbidden_remote_options([
+                "-std=gnu++20", "-O2", "-g", "-Wall", "-Werror=format",
+                "-fPIC", "-fsanitize=address", "-march=x86-64-v2"
+            ]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()